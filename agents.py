@@ -3,44 +3,53 @@ from agno.tools.serpapi import SerpApiTools
 from agno.models.google import Gemini
 from config import SERPAPI_KEY
 
-researcher = Agent(
-    name="Researcher",
-    instructions=[
-        "Identify the travel destination specified by the user.",
-        "Gather detailed information on the destination, including climate, culture, and safety tips.",
-        "Find popular attractions, landmarks, and must-visit places.",
-        "Search for activities that match the user’s interests and travel style.",
-        "Prioritize information from reliable sources and official travel guides.",
-        "Provide well-structured summaries with key insights and recommendations."
-    ],
-    model=Gemini(id="gemini-2.0-flash-exp"),
-    tools=[SerpApiTools(api_key=SERPAPI_KEY)],
-    add_datetime_to_instructions=True,
-)
+# Agent của agno giữ trạng thái (run_id, run_response, memory) trên chính object,
+# nên mỗi yêu cầu tạo agent mới thay vì dùng chung một instance giữa các thread.
+RESEARCHER_NAME = "Researcher"
+PLANNER_NAME = "Planner"
+HOTEL_RESTAURANT_FINDER_NAME = "Hotel & Restaurant Finder"
 
-planner = Agent(
-    name="Planner",
-    instructions=[
-        "Gather details about the user's travel preferences and budget.",
-        "Create a detailed itinerary with scheduled activities and estimated costs.",
-        "Ensure the itinerary includes transportation options and travel time estimates.",
-        "Optimize the schedule for convenience and enjoyment.",
-        "Present the itinerary in a structured format."
-    ],
-    model=Gemini(id="gemini-2.0-flash-exp"),
-    add_datetime_to_instructions=True,
-)
+def make_researcher():
+    return Agent(
+        name=RESEARCHER_NAME,
+        instructions=[
+            "Identify the travel destination specified by the user.",
+            "Gather detailed information on the destination, including climate, culture, and safety tips.",
+            "Find popular attractions, landmarks, and must-visit places.",
+            "Search for activities that match the user’s interests and travel style.",
+            "Prioritize information from reliable sources and official travel guides.",
+            "Provide well-structured summaries with key insights and recommendations."
+        ],
+        model=Gemini(id="gemini-2.0-flash-exp"),
+        tools=[SerpApiTools(api_key=SERPAPI_KEY)],
+        add_datetime_to_instructions=True,
+    )
 
-hotel_restaurant_finder = Agent(
-    name="Hotel & Restaurant Finder",
-    instructions=[
-        "Identify key locations in the user's travel itinerary.",
-        "Search for highly rated hotels near those locations.",
-        "Search for top-rated restaurants based on cuisine preferences and proximity.",
-        "Prioritize results based on user preferences, ratings, and availability.",
-        "Provide direct booking links or reservation options where possible."
-    ],
-    model=Gemini(id="gemini-2.0-flash-exp"),
-    tools=[SerpApiTools(api_key=SERPAPI_KEY)],
-    add_datetime_to_instructions=True,
-)
\ No newline at end of file
+def make_planner():
+    return Agent(
+        name=PLANNER_NAME,
+        instructions=[
+            "Gather details about the user's travel preferences and budget.",
+            "Create a detailed itinerary with scheduled activities and estimated costs.",
+            "Ensure the itinerary includes transportation options and travel time estimates.",
+            "Optimize the schedule for convenience and enjoyment.",
+            "Present the itinerary in a structured format."
+        ],
+        model=Gemini(id="gemini-2.0-flash-exp"),
+        add_datetime_to_instructions=True,
+    )
+
+def make_hotel_restaurant_finder():
+    return Agent(
+        name=HOTEL_RESTAURANT_FINDER_NAME,
+        instructions=[
+            "Identify key locations in the user's travel itinerary.",
+            "Search for highly rated hotels near those locations.",
+            "Search for top-rated restaurants based on cuisine preferences and proximity.",
+            "Prioritize results based on user preferences, ratings, and availability.",
+            "Provide direct booking links or reservation options where possible."
+        ],
+        model=Gemini(id="gemini-2.0-flash-exp"),
+        tools=[SerpApiTools(api_key=SERPAPI_KEY)],
+        add_datetime_to_instructions=True,
+    )
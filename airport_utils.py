@@ -0,0 +1,129 @@
+import re
+import unicodedata
+import pandas as pd
+from csv import Sniffer
+
+# ============== City/Country (text) -> IATA từ CSV =============
+def _normalize_text(s: str) -> str:
+    if not isinstance(s, str):
+        return ""
+    s = s.strip().lower()
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    s = re.sub(r"[^a-z0-9\s]", " ", s)
+    s = " ".join(s.split())
+    return s
+
+CITY_ALIASES = {
+    "tp hcm": "ho chi minh",
+    "tphcm": "ho chi minh",
+    "hcm": "ho chi minh",
+    "sai gon": "ho chi minh",
+    "saigon": "ho chi minh",
+    "tp ho chi minh": "ho chi minh",
+    "ha noi": "soc son",
+    "hn": "soc son",
+    "hanoi": "soc son",
+}
+
+COUNTRY_TO_ISO2 = {
+    "vn": "vn", "viet nam": "vn", "vietnam": "vn",
+    "fr": "fr", "france": "fr",
+    "us": "us", "usa": "us", "united states": "us", "united states of america": "us",
+    "uk": "gb", "gb": "gb", "great britain": "gb", "united kingdom": "gb",
+    "jp": "jp", "japan": "jp",
+    "kr": "kr", "south korea": "kr", "korea": "kr",
+    "de": "de", "germany": "de",
+    "it": "it", "italy": "it",
+    "es": "es", "spain": "es",
+    "au": "au", "australia": "au",
+    "ca": "ca", "canada": "ca",
+    "cn": "cn", "china": "cn",
+    "sg": "sg", "singapore": "sg",
+    "th": "th", "thailand": "th",
+    "my": "my", "malaysia": "my",
+    "id": "id", "indonesia": "id",
+    "ph": "ph", "philippines": "ph",
+    "tw": "tw", "taiwan": "tw",
+    "hk": "hk", "hong kong": "hk",
+    "ru": "ru", "russia": "ru",
+    "br": "br", "brazil": "br",
+    "mx": "mx", "mexico": "mx",
+    "ae": "ae", "uae": "ae", "united arab emirates": "ae",
+}
+
+def load_airports(csv_path: str = "airports.csv") -> pd.DataFrame:
+    with open(csv_path, "r", encoding="utf-8", errors="ignore") as f:
+        sample = f.read(4096)
+        try:
+            sep = Sniffer().sniff(sample).delimiter
+        except Exception:
+            sep = ","
+    df = pd.read_csv(csv_path, sep=sep, dtype=str, encoding="utf-8", engine="python")
+
+    required = ["code", "name", "country", "city", "state"]
+    for c in required:
+        if c not in df.columns:
+            raise ValueError(f"Thiếu cột {c} trong CSV (cần: {', '.join(required)})")
+
+    for c in ["code", "name", "country", "city", "state"]:
+        df[c] = df[c].fillna("").astype(str).str.strip()
+
+    df = df[df["code"].str.len() == 3].copy()
+
+    df["n_city"]  = df["city"].map(_normalize_text)
+    df["n_state"] = df["state"].map(_normalize_text)
+    df["n_name"]  = df["name"].map(_normalize_text)
+    df["n_ctry"]  = df["country"].map(_normalize_text)
+
+    df["n_city_slim"]  = df["n_city"].str.replace(r"\bcity\b", "", regex=True).str.strip()
+    df["n_state_slim"] = df["n_state"].str.replace(r"\bcity\b", "", regex=True).str.strip()
+
+    return df[["code","name","country","city","state","n_city","n_state","n_name","n_ctry","n_city_slim","n_state_slim"]]
+
+def _split_city_country(q: str):
+    parts = [p.strip() for p in (q or "").split(",")]
+    city_inp = _normalize_text(parts[0] if parts else "")
+    ctry_inp = _normalize_text(parts[1] if len(parts) > 1 else "")
+
+    city_inp = CITY_ALIASES.get(city_inp, city_inp)
+    if ctry_inp:
+        ctry_inp = COUNTRY_TO_ISO2.get(ctry_inp, ctry_inp)
+    return city_inp, ctry_inp
+
+def find_iata_options(query: str, airports_df: pd.DataFrame, max_preview: int = 40):
+    city_q, ctry_q = _split_city_country(query)
+    if not city_q:
+        return [], pd.DataFrame()
+
+    cand = airports_df[
+        (airports_df["n_city"] == city_q) |
+        (airports_df["n_city_slim"] == city_q) |
+        (airports_df["n_state"] == city_q) |
+        (airports_df["n_state_slim"] == city_q)
+    ].copy()
+
+    if cand.empty:
+        cand = airports_df[
+            airports_df["n_city"].str.contains(city_q, na=False) |
+            airports_df["n_city_slim"].str.contains(city_q, na=False) |
+            airports_df["n_state"].str.contains(city_q, na=False) |
+            airports_df["n_state_slim"].str.contains(city_q, na=False) |
+            airports_df["n_name"].str.contains(city_q, na=False)
+        ].copy()
+
+    if ctry_q and not cand.empty:
+        cand = cand[cand["n_ctry"] == ctry_q]
+
+    options, seen = [], set()
+    for _, r in cand.iterrows():
+        code = r["code"]
+        if code in seen:
+            continue
+        seen.add(code)
+        label_loc = r["city"] or r["state"]
+        label = f"{code} — {r['name']} ({label_loc}, {r['country']})"
+        options.append((label, code))
+
+    preview = cand.head(max_preview)[["code","name","city","state","country"]]
+    return options, preview
@@ -0,0 +1,255 @@
+"""Lập kế hoạch du lịch hàng loạt (không cần UI Streamlit).
+
+Đọc yêu cầu từ JSONL, mỗi dòng một chuyến đi, ví dụ:
+    {"id": "camp-001", "origin": "TP.HCM, VN", "destination": "Paris, FR",
+     "departure_date": "2025-12-01", "return_date": "2025-12-06", "num_days": 5,
+     "theme": "Du lịch cặp đôi", "preferences": "Nghỉ dưỡng", "budget": 1500}
+
+Kết quả được ghi nối tiếp (append) vào JSONL ngay khi từng yêu cầu xong, nên có thể
+chạy lại cùng lệnh để tiếp tục sau khi bị ngắt:
+    python batch_plan.py requests.jsonl results.jsonl --workers 4 --rate 20
+"""
+import argparse
+import datetime as _dt
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+
+from airport_utils import load_airports, find_iata_options
+from config import ITINERARY_RETENTION_DAYS
+from trip_planner import DEFAULT_REQUEST, plan_trip
+from itinerary_store import ItineraryStore
+from utils import RateLimiter, set_backend_rate
+
+# Dữ liệu sân bay + kho kế hoạch dùng chung trong mỗi process (khởi tạo một lần qua _init_worker)
+_AIRPORTS_DF = None
+_STORE = None
+_REUSE_DAYS = 0
+
+def _init_worker(csv_path: str, store_path: str = None, reuse_days: float = 0, backend_rates=None):
+    global _AIRPORTS_DF, _STORE, _REUSE_DAYS
+    for kind, per_minute in (backend_rates or {}).items():
+        set_backend_rate(kind, per_minute)
+    if _AIRPORTS_DF is None:
+        _AIRPORTS_DF = load_airports(csv_path)
+    if store_path and _STORE is None:
+        _STORE = ItineraryStore(store_path, retention_days=ITINERARY_RETENTION_DAYS)
+    _REUSE_DAYS = reuse_days
+
+@lru_cache(maxsize=2048)
+def _resolve_iata(query: str):
+    """Lấy mã IATA đầu tiên khớp với 'Thành phố, Quốc gia' (cache theo chuỗi nhập)."""
+    options, _ = find_iata_options(query, _AIRPORTS_DF)
+    return options[0][1] if options else None
+
+def _infer_num_days(req: dict) -> int:
+    if req.get("num_days"):
+        return int(req["num_days"])
+    try:
+        d0 = _dt.date.fromisoformat(str(req["departure_date"]))
+        r0 = _dt.date.fromisoformat(str(req["return_date"]))
+        if (r0 - d0).days > 0:
+            return (r0 - d0).days
+    except Exception:
+        pass
+    return DEFAULT_REQUEST["num_days"]
+
+def _plan_one(req_id: str, req: dict) -> dict:
+    """Chạy pipeline cho một yêu cầu; luôn trả về một bản ghi (không ném lỗi)."""
+    started = time.perf_counter()
+    record = {
+        "id": req_id,
+        "origin": req.get("origin"),
+        "destination": req.get("destination"),
+        "departure_date": req.get("departure_date"),
+        "return_date": req.get("return_date"),
+    }
+
+    def _notice(msg):
+        print(f"[{req_id}] {msg}", file=sys.stderr, flush=True)
+
+    try:
+        source = req.get("origin_iata") or _resolve_iata(req.get("origin") or "")
+        destination = req.get("destination_iata") or _resolve_iata(req.get("destination") or "")
+        if not source or not destination:
+            raise ValueError(f"Không tìm thấy sân bay phù hợp (khởi hành={source}, đến={destination})")
+        if not req.get("departure_date") or not req.get("return_date"):
+            raise ValueError("Thiếu departure_date hoặc return_date")
+
+        num_days = _infer_num_days(req)
+        result = plan_trip(
+            source=source,
+            destination=destination,
+            destination_city=req.get("destination") or destination,
+            departure_date=req["departure_date"],
+            return_date=req["return_date"],
+            num_days=num_days,
+            travel_theme=req.get("theme") or DEFAULT_REQUEST["theme"],
+            activity_preferences=req.get("preferences") or DEFAULT_REQUEST["preferences"],
+            budget=float(req.get("budget") or DEFAULT_REQUEST["budget"]),
+            flight_class=req.get("flight_class") or DEFAULT_REQUEST["flight_class"],
+            hotel_rating=req.get("hotel_rating") or DEFAULT_REQUEST["hotel_rating"],
+            on_notice=_notice,
+            store=_STORE,
+            reuse_max_age_days=_REUSE_DAYS,
+        )
+        result.pop("flight_data", None)  # phản hồi SerpAPI gốc, không cần ghi ra JSONL
+        # Có bước dùng nội dung fallback -> "partial" để lần chạy sau với --retry-errors tạo lại
+        record.update({"status": "partial" if result["fallbacks"] else "ok",
+                       "source_iata": source, "destination_iata": destination,
+                       "num_days": num_days, **result})
+    except Exception as e:
+        record.update({"status": "error", "error": f"{type(e).__name__}: {e}",
+                       "traceback": traceback.format_exc()})
+    record["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return record
+
+# ============== Đọc/ghi JSONL ==================================
+def iter_requests(path: str):
+    """Sinh (id, request) từng dòng một để không nạp cả file vào bộ nhớ."""
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"[⚠️] Bỏ qua dòng {lineno}: JSON không hợp lệ ({e})", file=sys.stderr)
+                continue
+            if not isinstance(req, dict):
+                print(f"[⚠️] Bỏ qua dòng {lineno}: cần một object JSON, nhận {type(req).__name__}",
+                      file=sys.stderr)
+                continue
+            yield str(req.get("id") or f"line-{lineno}"), req
+
+def load_finished_ids(path: str, retry_errors: bool = False) -> set:
+    """Đọc file kết quả cũ để biết yêu cầu nào đã xong (phục vụ chạy tiếp)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # dòng ghi dở khi bị ngắt
+            if rec.get("status") == "ok" or (rec.get("status") in ("error", "partial") and not retry_errors):
+                done.add(str(rec.get("id")))
+    return done
+
+def _open_output(path: str):
+    out = open(path, "a+", encoding="utf-8")
+    # nếu lần trước bị ngắt giữa dòng, xuống dòng để bản ghi mới không dính vào
+    if out.tell() > 0:
+        out.seek(out.tell() - 1)
+        if out.read(1) != "\n":
+            out.write("\n")
+    return out
+
+# ============== Chạy hàng loạt =================================
+def run_batch(input_path, output_path, workers=4, executor="thread", rate_per_minute=0.0,
+              airports_csv="airports.csv", retry_errors=False, store_path=None, reuse_days=0,
+              serpapi_rate=0.0, llm_rate=0.0):
+    done = load_finished_ids(output_path, retry_errors=retry_errors)
+    limiter = RateLimiter(rate_per_minute)
+    max_inflight = max(1, workers) * 2
+    stats = {"ok": 0, "partial": 0, "error": 0, "skipped": 0, "reused": 0}
+
+    backend_rates = {"serpapi": serpapi_rate, "llm": llm_rate}
+    if executor == "process":
+        # mỗi process có limiter riêng -> chia đều quota cho các process
+        backend_rates = {k: v / max(1, workers) for k, v in backend_rates.items()}
+    init_args = (airports_csv, store_path, reuse_days, backend_rates)
+    if executor == "process":
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args)
+    else:
+        _init_worker(*init_args)
+        pool = ThreadPoolExecutor(max_workers=workers)
+
+    out = _open_output(output_path)
+    pending = {}
+
+    def _drain(return_when):
+        finished, _ = wait(pending, return_when=return_when)
+        for fut in finished:
+            req_id = pending.pop(fut)
+            try:
+                rec = fut.result()
+            except Exception as e:  # vd: BrokenProcessPool
+                rec = {"id": req_id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            stats[rec["status"]] += 1
+            stats["reused"] += 1 if rec.get("reused") else 0
+            icon = {"ok": "✅", "partial": "⚠️"}.get(rec["status"], "❌")
+            print(f"[{icon}] {req_id} ({rec.get('elapsed_s', 0)}s)",
+                  file=sys.stderr, flush=True)
+
+    try:
+        for req_id, req in iter_requests(input_path):
+            if req_id in done:
+                stats["skipped"] += 1
+                continue
+            done.add(req_id)  # tránh chạy trùng khi id lặp trong file đầu vào
+            while len(pending) >= max_inflight:
+                _drain(FIRST_COMPLETED)
+            limiter.acquire()
+            pending[pool.submit(_plan_one, req_id, req)] = req_id
+        while pending:
+            _drain(FIRST_COMPLETED)
+    except KeyboardInterrupt:
+        print("[⚠️] Đã dừng. Chạy lại cùng lệnh để tiếp tục.", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    except Exception:
+        # lỗi ngoài dự kiến khi đọc đầu vào: vẫn ghi các kết quả đang chạy dở trước khi dừng
+        while pending:
+            _drain(FIRST_COMPLETED)
+        raise
+    finally:
+        out.close()
+    pool.shutdown()
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lập kế hoạch du lịch hàng loạt từ JSONL.")
+    parser.add_argument("input", help="File JSONL chứa yêu cầu")
+    parser.add_argument("output", help="File JSONL kết quả (ghi nối tiếp, dùng để chạy tiếp)")
+    parser.add_argument("--workers", type=int, default=4, help="Số yêu cầu chạy song song")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Số chuyến (dòng JSONL) tối đa bắt đầu mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--serpapi-rate", type=float, default=30.0,
+                        help="Số lần gọi SerpAPI (tìm chuyến bay) tối đa mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--llm-rate", type=float, default=15.0,
+                        help="Số lần gọi Gemini (agent.run, gồm cả retry) tối đa mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--airports", default="airports.csv", help="Đường dẫn airports.csv")
+    parser.add_argument("--retry-errors", action="store_true",
+                        help="Chạy lại các yêu cầu đã lỗi hoặc chỉ có nội dung fallback (partial)")
+    parser.add_argument("--store", default=None,
+                        help="File SQLite lưu kế hoạch (vd: itineraries.db); bỏ trống = không lưu/dùng lại")
+    parser.add_argument("--reuse-days", type=float, default=7,
+                        help="Dùng lại kế hoạch đã tạo cho cùng chuyến & lựa chọn trong N ngày gần đây "
+                             "(0 = luôn tạo mới, chỉ lưu)")
+    args = parser.parse_args(argv)
+
+    try:
+        stats = run_batch(args.input, args.output, workers=args.workers, executor=args.executor,
+                          rate_per_minute=args.rate, airports_csv=args.airports,
+                          retry_errors=args.retry_errors, store_path=args.store,
+                          reuse_days=args.reuse_days, serpapi_rate=args.serpapi_rate,
+                          llm_rate=args.llm_rate)
+    except KeyboardInterrupt:
+        return 130
+    print(f"Xong: {stats['ok']} thành công ({stats['reused']} dùng lại từ kho), "
+          f"{stats['partial']} có fallback, {stats['error']} lỗi, {stats['skipped']} bỏ qua (đã có).",
+          file=sys.stderr)
+    return 0 if stats["error"] == 0 and stats["partial"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
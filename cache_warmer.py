@@ -0,0 +1,327 @@
+"""Làm nóng cache SerpAPI/Gemini cho các tuyến bay và điểm đến phổ biến.
+
+Danh sách mục tiêu lấy từ file cấu hình JSON và/hoặc lịch sử kế hoạch (ItineraryStore), ví dụ:
+    {
+      "routes": [{"origin": "SGN", "destination": "CDG", "destination_city": "Paris, FR"},
+                 {"origin": "TP.HCM, VN", "destination": "Tokyo, JP"}],
+      "date_offsets": [[7, 12], [14, 19]],
+      "destinations": ["Paris, FR", "Singapore, SG"],
+      "themes": ["Du lịch cặp đôi", "Du lịch gia đình"],
+      "num_days": [3, 5],
+      "defaults": {"preferences": "Nghỉ dưỡng, khám phá di tích lịch sử", "budget": 1000}
+    }
+
+Mục nào còn hạn lâu hơn --refresh-margin-hours thì bỏ qua; còn lại được gọi lại (trong giới hạn
+quota và số luồng) theo thứ tự chuyến bay -> nghiên cứu/khách sạn -> lịch trình. Mỗi mục chỉ gọi
+một lần, không retry, nên quota đếm đúng số lần gọi; riêng các lượt tìm kiếm SerpApiTools mà agent
+nghiên cứu/khách sạn tự gọi bên trong không được tính vào --max-serpapi-calls. Mục tiêu từ lịch sử
+dùng đúng sở thích/ngân sách/hạng vé/hạng khách sạn đã lưu, nên prompt khớp với yêu cầu thật từ UI.
+Cuối mỗi lượt, từng chuyến (tuyến + ngày) được chạy lại bằng plan_trip chỉ đọc cache để báo số chuyến
+phục vụ được mà không gọi backend ("servable" trong báo cáo). Chạy định kỳ bằng cron hoặc --every:
+    python cache_warmer.py --config warm.json --from-history itineraries.db --max-llm-calls 100
+"""
+import argparse
+import datetime as _dt
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from airport_utils import load_airports, find_iata_options
+import agents
+from itinerary_store import ItineraryStore
+from response_cache import CacheMiss, get_default_cache
+from trip_planner import (
+    DEFAULT_REQUEST, plan_trip, safe_agent_run, agent_cache_key, FallbackResponse, _fallback_pick_flights,
+    build_research_prompt, build_hotel_restaurant_prompt, build_planning_prompt,
+)
+from utils import RateLimiter, fetch_flights, flight_cache_key, extract_cheapest_flights
+
+DEFAULT_DATE_OFFSETS = [[7, 12], [14, 19]]
+STAGES = [("flights", "serpapi"), ("research", "llm"), ("hotels", "llm"), ("planner", "llm")]
+_IATA_RE = re.compile(r"^[A-Z]{3}$")
+
+class QuotaBudget:
+    """Số lần gọi tối đa cho mỗi loại backend trong một lượt làm nóng (None = không giới hạn).
+
+    "serpapi" chỉ đếm các lượt tìm chuyến bay; SerpApiTools do agent tự gọi không đếm được ở đây.
+    """
+    def __init__(self, serpapi=None, llm=None):
+        self.limits = {"serpapi": serpapi, "llm": llm}
+        self.used = {"serpapi": 0, "llm": 0}
+        self._lock = threading.Lock()
+
+    def try_take(self, kind: str) -> bool:
+        with self._lock:
+            limit = self.limits[kind]
+            if limit is not None and self.used[kind] >= limit:
+                return False
+            self.used[kind] += 1
+            return True
+
+# ============== Xây danh sách mục tiêu =========================
+def _resolve(place, airports_df):
+    """Trả về (iata, nhãn thành phố hoặc None) cho 'SGN' hoặc 'TP.HCM, VN'."""
+    place = (place or "").strip()
+    if _IATA_RE.match(place):
+        return place, None
+    options, _ = find_iata_options(place, airports_df)
+    return (options[0][1] if options else None), place
+
+def _trip_inputs(defaults, recorded=None):
+    """Lựa chọn của người dùng cho một chuyến: lấy từ lịch sử nếu có, còn lại theo defaults."""
+    recorded = recorded or {}
+    budget = recorded.get("budget")
+    return {
+        "preferences": recorded.get("preferences") or defaults["preferences"],
+        "budget": float(budget if budget is not None else defaults["budget"]),
+        "flight_class": recorded.get("flight_class") or defaults["flight_class"],
+        "hotel_rating": recorded.get("hotel_rating") or defaults["hotel_rating"],
+        "visa_required": bool(recorded.get("visa_required", defaults.get("visa_required", False))),
+        "travel_insurance": bool(recorded.get("travel_insurance", defaults.get("travel_insurance", False))),
+    }
+
+def build_targets(config=None, history=None, airports_df=None, today=None):
+    """Sinh mục tiêu cho từng loại cache (đã loại trùng, giữ thứ tự ưu tiên).
+
+    Mỗi mục tiêu mang sẵn đầu vào prompt (sở thích, ngân sách, hạng vé/khách sạn...): mục từ lịch sử
+    dùng đúng lựa chọn đã lưu, mục từ file cấu hình dùng "defaults".
+    """
+    config = config or {}
+    history = history or []
+    today = today or _dt.date.today()
+    defaults = {**DEFAULT_REQUEST, **config.get("defaults", {})}
+    offsets = config.get("date_offsets") or DEFAULT_DATE_OFFSETS
+    dates = [(today + _dt.timedelta(days=d), today + _dt.timedelta(days=r)) for d, r in offsets]
+    themes = config.get("themes") or [defaults["theme"]]
+    days_list = config.get("num_days") or [defaults["num_days"]]
+
+    routes = {}  # (src, dst) -> destination_city
+    for r in config.get("routes", []):
+        if isinstance(r, str):
+            r = dict(zip(("origin", "destination"), r.split("-", 1)))
+        src, _ = _resolve(r.get("origin"), airports_df)
+        dst, dst_city = _resolve(r.get("destination"), airports_df)
+        if src and dst:
+            routes.setdefault((src, dst), r.get("destination_city") or dst_city)
+
+    config_inputs = _trip_inputs(defaults)
+    trips = []  # (src hoặc None, dst hoặc None, destination_city, theme, num_days, inputs)
+    for (src, dst), city in routes.items():
+        for theme in themes:
+            for days in days_list:
+                trips.append((src, dst, city, theme, int(days), config_inputs))
+    for city in config.get("destinations", []):
+        for theme in themes:
+            for days in days_list:
+                trips.append((None, None, city, theme, int(days), config_inputs))
+    for h in history:
+        if h.get("source_iata") and h.get("destination_iata"):
+            routes.setdefault((h["source_iata"], h["destination_iata"]), h.get("destination_label"))
+        trips.append((h.get("source_iata"), h.get("destination_iata"), h.get("destination_label"),
+                      h["theme"], int(h["num_days"]), _trip_inputs(defaults, h)))
+
+    targets = {kind: {} for kind, _ in STAGES}
+    for src, dst in routes:
+        for dep, ret in dates:
+            targets["flights"][(src, dst, dep, ret)] = {"source": src, "destination": dst,
+                                                        "departure_date": dep, "return_date": ret}
+    for src, dst, city, theme, days, inputs in trips:
+        if not city:
+            continue
+        common = {"destination_city": city, "theme": theme, "num_days": days, **inputs}
+        targets["research"][(city, theme, days, inputs["preferences"])] = common
+        targets["hotels"][(city, theme, days, inputs["preferences"], int(inputs["budget"]),
+                           inputs["hotel_rating"])] = common
+        if src and dst:
+            for dep, ret in dates:
+                targets["planner"][(src, dst, dep, ret, city, theme, days, *inputs.values())] = {
+                    **common, "source": src, "destination": dst, "departure_date": dep, "return_date": ret,
+                }
+    return {kind: list(t.values()) for kind, t in targets.items()}
+
+# ============== Cache key + thực thi từng mục tiêu =============
+def _describe(kind, t):
+    if kind == "flights":
+        return f"{t['source']}→{t['destination']} {t['departure_date']}/{t['return_date']}"
+    label = f"{t['destination_city']} | {t['theme']} | {t['num_days']} ngày | {t['preferences']}"
+    if kind in ("hotels", "planner"):
+        label += f" | {int(t['budget'])} USD | {t['hotel_rating']}"
+    if kind == "planner":
+        label = f"{t['source']}→{t['destination']} {t['departure_date']}/{t['return_date']} | " + label
+    return label
+
+def _research_prompt(t):
+    return build_research_prompt(t["destination_city"], t["preferences"], t["theme"], t["num_days"])
+
+def _hotels_prompt(t):
+    return build_hotel_restaurant_prompt(t["destination_city"], t["budget"], t["hotel_rating"],
+                                         t["preferences"], t["num_days"], t["theme"])
+
+def _planner_prompt(t, cache):
+    """Prompt lịch trình giống hệt UI với cùng lựa chọn; None nếu thiếu dữ liệu đã cache."""
+    data = cache.get("flights", flight_cache_key(t["source"], t["destination"], t["departure_date"], t["return_date"]))
+    research = cache.get("agent", agent_cache_key(agents.RESEARCHER_NAME, _research_prompt(t)))
+    hotels = cache.get("agent", agent_cache_key(agents.HOTEL_RESTAURANT_FINDER_NAME, _hotels_prompt(t)))
+    if data is None or research is None or hotels is None:
+        return None
+    cheapest_flights = extract_cheapest_flights(data) or _fallback_pick_flights(data)
+    if not cheapest_flights:
+        return None  # UI sẽ thử lệch ±1 ngày, các ngày đó không nằm trong danh sách làm nóng
+    return build_planning_prompt(t["destination_city"], t["num_days"], t["theme"], t["preferences"], t["budget"],
+                                 t["flight_class"], t["hotel_rating"], t["visa_required"], t["travel_insurance"],
+                                 research, cheapest_flights, hotels)
+
+def _cache_entry(kind, t, cache):
+    """(namespace, key, callable làm nóng) cho một mục tiêu; key None = thiếu phụ thuộc."""
+    if kind == "flights":
+        key = flight_cache_key(t["source"], t["destination"], t["departure_date"], t["return_date"])
+        return "flights", key, lambda: fetch_flights(t["source"], t["destination"], t["departure_date"],
+                                                    t["return_date"], refresh=True)
+    make_agent, agent_name, prompt = {
+        "research": (agents.make_researcher, agents.RESEARCHER_NAME, lambda: _research_prompt(t)),
+        "hotels": (agents.make_hotel_restaurant_finder, agents.HOTEL_RESTAURANT_FINDER_NAME,
+                   lambda: _hotels_prompt(t)),
+        "planner": (agents.make_planner, agents.PLANNER_NAME, lambda: _planner_prompt(t, cache)),
+    }[kind]
+    prompt = prompt()
+    if prompt is None:
+        return "agent", None, None
+    return "agent", agent_cache_key(agent_name, prompt), lambda: safe_agent_run(
+        make_agent(), prompt, retries=1, base_wait=0.0, component_name=f"warm:{kind}",
+        on_retry=_notice, on_fail=_notice, refresh=True,
+    )
+
+def check_servable(planner_targets):
+    """Chạy lại plan_trip chỉ bằng cache cho từng chuyến (src/dst/ngày) đã làm nóng.
+
+    Chuyến "servable" là chuyến mà UI với cùng lựa chọn sẽ lập xong không cần gọi SerpAPI/Gemini.
+    """
+    result = {"targets": len(planner_targets), "servable": 0, "missing": []}
+    for t in planner_targets:
+        try:
+            plan_trip(t["source"], t["destination"], t["destination_city"], t["departure_date"], t["return_date"],
+                      t["num_days"], t["theme"], t["preferences"], t["budget"], flight_class=t["flight_class"],
+                      hotel_rating=t["hotel_rating"], visa_required=t["visa_required"],
+                      travel_insurance=t["travel_insurance"], on_notice=lambda msg: None, cache_only=True)
+            result["servable"] += 1
+        except CacheMiss as e:
+            result["missing"].append({"target": _describe("planner", t), "miss": str(e)})
+    return result
+
+def _notice(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+# ============== Một lượt làm nóng ==============================
+def warm_once(targets, cache, budget, concurrency=4, rate_per_minute=0.0, refresh_margin_s=3600.0):
+    limiter = RateLimiter(rate_per_minute)
+    coverage, items = {}, []
+    purged = cache.purge_expired()
+    if purged:
+        _notice(f"[🧹] Đã xoá {purged} mục cache hết hạn")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for kind, quota_kind in STAGES:  # tuần tự theo loại vì planner cần flights/research/hotels
+            counts = {"targets": len(targets[kind]), "fresh": 0, "warmed": 0, "failed": 0,
+                      "skipped_budget": 0, "skipped_dependency": 0}
+            futures = {}
+            for t in targets[kind]:
+                namespace, key, warm = _cache_entry(kind, t, cache)
+                if key is None:
+                    status = "skipped_dependency"
+                else:
+                    remaining = cache.expires_in(namespace, key)
+                    if remaining is not None and remaining > refresh_margin_s:
+                        status = "fresh"
+                    elif not budget.try_take(quota_kind):
+                        status = "skipped_budget"
+                    else:
+                        limiter.acquire()
+                        futures[pool.submit(warm)] = (t, namespace, key)
+                        continue
+                counts[status] += 1
+                items.append({"kind": kind, "target": _describe(kind, t), "status": status})
+
+            for fut in as_completed(futures):
+                t, namespace, key = futures[fut]
+                try:
+                    resp = fut.result()
+                    ok = not isinstance(resp, FallbackResponse) and cache.expires_in(namespace, key) is not None
+                    status = "warmed" if ok else "failed"
+                except Exception as e:
+                    _notice(f"[❌] warm:{kind} {_describe(kind, t)}: {e}")
+                    status = "failed"
+                counts[status] += 1
+                items.append({"kind": kind, "target": _describe(kind, t), "status": status})
+
+            counts["coverage"] = (round((counts["fresh"] + counts["warmed"]) / counts["targets"], 4)
+                                  if counts["targets"] else None)
+            coverage[kind] = counts
+            _notice(f"[🔥] {kind}: {counts['fresh'] + counts['warmed']}/{counts['targets']} nóng "
+                    f"({counts['warmed']} mới, {counts['failed']} lỗi, {counts['skipped_budget']} hết quota, "
+                    f"{counts['skipped_dependency']} thiếu phụ thuộc)")
+
+    servable = check_servable(targets["planner"])
+    _notice(f"[🔎] {servable['servable']}/{servable['targets']} chuyến phổ biến phục vụ được chỉ từ cache "
+            f"(không gọi SerpAPI/Gemini)")
+    return {
+        "finished_at": _dt.datetime.now().isoformat(timespec="seconds"),
+        "quota": {k: {"limit": budget.limits[k], "used": budget.used[k]} for k in budget.limits},
+        "purged_expired": purged,
+        "coverage": coverage,
+        "servable": servable,
+        "items": items,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Làm nóng cache SerpAPI/Gemini cho tuyến/điểm đến phổ biến.")
+    parser.add_argument("--config", help="File JSON: routes, date_offsets, destinations, themes, num_days, defaults")
+    parser.add_argument("--from-history", metavar="DB", help="Lấy thêm mục tiêu từ kho kế hoạch (itineraries.db)")
+    parser.add_argument("--history-days", type=float, default=30, help="Chỉ xét lịch sử trong N ngày gần đây")
+    parser.add_argument("--history-limit", type=int, default=20, help="Số tổ hợp phổ biến nhất lấy từ lịch sử")
+    parser.add_argument("--max-serpapi-calls", type=int, default=100,
+                        help="Quota tìm chuyến bay SerpAPI mỗi lượt (không gồm SerpApiTools do agent tự gọi)")
+    parser.add_argument("--max-llm-calls", type=int, default=100, help="Quota Gemini mỗi lượt (mỗi mục gọi một lần)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số lời gọi song song")
+    parser.add_argument("--rate", type=float, default=0.0, help="Số lời gọi tối đa mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--refresh-margin-hours", type=float, default=1.0,
+                        help="Làm mới các mục sẽ hết hạn trong vòng N giờ")
+    parser.add_argument("--airports", default="airports.csv", help="Đường dẫn airports.csv")
+    parser.add_argument("--report", default="cache_warm_report.json", help="File JSON báo cáo độ phủ")
+    parser.add_argument("--every", type=float, default=0, help="Lặp lại mỗi N phút (0 = chạy một lần)")
+    args = parser.parse_args(argv)
+
+    cache = get_default_cache()
+    if cache is None:
+        print("[❌] Cache đang tắt (RESPONSE_CACHE_PATH rỗng), không có gì để làm nóng.", file=sys.stderr)
+        return 2
+    config = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    airports_df = load_airports(args.airports)
+
+    while True:
+        started = _dt.datetime.now().isoformat(timespec="seconds")
+        history = []
+        if args.from_history:
+            store = ItineraryStore(args.from_history)
+            history = store.popular_trips(since_days=args.history_days, limit=args.history_limit)
+            store.close()
+        targets = build_targets(config, history, airports_df)
+        budget = QuotaBudget(serpapi=args.max_serpapi_calls, llm=args.max_llm_calls)
+        report = {"started_at": started, **warm_once(
+            targets, cache, budget, concurrency=args.concurrency, rate_per_minute=args.rate,
+            refresh_margin_s=args.refresh_margin_hours * 3600,
+        )}
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        _notice(f"[✅] Đã ghi báo cáo: {args.report}")
+        if not args.every:
+            return 0
+        time.sleep(args.every * 60)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,3 +5,11 @@ load_dotenv()
 SERPAPI_KEY = os.getenv("SERPAPI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
+
+ITINERARY_DB_PATH = os.getenv("ITINERARY_DB_PATH", "itineraries.db")
+ITINERARY_MAX_AGE_DAYS = float(os.getenv("ITINERARY_MAX_AGE_DAYS", "7"))
+ITINERARY_RETENTION_DAYS = float(os.getenv("ITINERARY_RETENTION_DAYS", "30"))
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.db")
+FLIGHT_CACHE_TTL_HOURS = float(os.getenv("FLIGHT_CACHE_TTL_HOURS", "6"))
+AGENT_CACHE_TTL_HOURS = float(os.getenv("AGENT_CACHE_TTL_HOURS", "24"))
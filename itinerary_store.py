@@ -0,0 +1,156 @@
+"""Kho lưu kế hoạch du lịch đã tạo (SQLite) để dùng lại thay vì gọi lại agent."""
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# Ngưỡng ngân sách (USD) để gom các kế hoạch "tương tự" vào cùng một nhóm
+BUDGET_BANDS = [500, 1000, 2000, 3500, 5000]
+
+def budget_band(budget) -> int:
+    """Trả về chỉ số nhóm ngân sách: 0 (<500), 1 (500–999), ..., len(BUDGET_BANDS) (>=5000)."""
+    try:
+        b = float(budget)
+    except (TypeError, ValueError):
+        return 0
+    for i, upper in enumerate(BUDGET_BANDS):
+        if b < upper:
+            return i
+    return len(BUDGET_BANDS)
+
+def normalize_preferences(text) -> str:
+    """Chuẩn hoá sở thích để so khớp: chữ thường, gộp khoảng trắng, tách theo dấu phẩy/chấm phẩy rồi sắp xếp."""
+    text = unicodedata.normalize("NFC", str(text or "")).lower()
+    parts = {" ".join(p.split()).strip(" .") for p in re.split(r"[,;\n]", text)}
+    return ", ".join(sorted(p for p in parts if p))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at         REAL    NOT NULL,
+    source_iata        TEXT    NOT NULL,
+    destination_iata   TEXT    NOT NULL,
+    destination_label  TEXT,
+    departure_date     TEXT    NOT NULL,
+    return_date        TEXT    NOT NULL,
+    theme              TEXT    NOT NULL,
+    num_days           INTEGER NOT NULL,
+    budget             REAL,
+    budget_band        INTEGER NOT NULL,
+    flight_class       TEXT    NOT NULL,
+    hotel_rating       TEXT    NOT NULL,
+    visa_required      INTEGER NOT NULL DEFAULT 0,
+    travel_insurance   INTEGER NOT NULL DEFAULT 0,
+    preferences        TEXT,
+    preferences_norm   TEXT    NOT NULL,
+    flights_json       TEXT,
+    research           TEXT,
+    hotels_restaurants TEXT,
+    itinerary          TEXT,
+    reuse_count        INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_plans_lookup
+    ON plans (destination_iata, source_iata, departure_date, return_date, theme, num_days, budget_band,
+              created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_plans_created ON plans (created_at);
+"""
+
+_PLAN_COLUMNS = ("id", "created_at", "source_iata", "destination_iata", "destination_label", "departure_date",
+                 "return_date", "theme", "num_days", "budget", "budget_band", "flight_class", "hotel_rating",
+                 "visa_required", "travel_insurance", "preferences", "flights_json", "research",
+                 "hotels_restaurants", "itinerary")
+
+class ItineraryStore:
+    """Lưu/tra cứu kế hoạch theo đúng chuyến (tuyến + ngày) và lựa chọn của người dùng.
+
+    Kế hoạch chỉ được dùng lại khi khớp tuyến, ngày bay, chủ đề, số ngày, nhóm ngân sách, hạng vé,
+    hạng khách sạn, visa/bảo hiểm và sở thích (đã chuẩn hoá), nên có thể trả nguyên kế hoạch mà không
+    gọi lại SerpAPI/Gemini. Một kết nối dùng chung cho nhiều thread (Streamlit, batch_plan), được bảo
+    vệ bằng lock. retention_days: khi mở kho, xoá các kế hoạch cũ hơn số ngày này (None = giữ tất cả).
+    """
+    def __init__(self, db_path: str = "itineraries.db", retention_days: float = None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        if retention_days:
+            self.prune(retention_days)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def save(self, source_iata, destination_iata, departure_date, return_date, theme, num_days, budget,
+             research, hotels_restaurants, itinerary, flights=None, destination_label=None,
+             flight_class="Phổ thông", hotel_rating="Bất kỳ", visa_required=False, travel_insurance=False,
+             preferences=None) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO plans (created_at, source_iata, destination_iata, destination_label, departure_date,"
+                " return_date, theme, num_days, budget, budget_band, flight_class, hotel_rating, visa_required,"
+                " travel_insurance, preferences, preferences_norm, flights_json, research,"
+                " hotels_restaurants, itinerary)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), source_iata, destination_iata, destination_label, str(departure_date),
+                 str(return_date), theme, int(num_days), budget, budget_band(budget), flight_class, hotel_rating,
+                 int(bool(visa_required)), int(bool(travel_insurance)), preferences,
+                 normalize_preferences(preferences),
+                 json.dumps(flights or [], ensure_ascii=False, default=str),
+                 research, hotels_restaurants, itinerary),
+            )
+            return cur.lastrowid
+
+    def find_recent(self, source_iata, destination_iata, departure_date, return_date, theme, num_days, budget,
+                    flight_class="Phổ thông", hotel_rating="Bất kỳ", visa_required=False, travel_insurance=False,
+                    preferences=None, max_age_days: float = 7):
+        """Kế hoạch mới nhất (trong max_age_days) khớp đúng chuyến và lựa chọn, hoặc None."""
+        min_created = time.time() - max_age_days * 86400
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_PLAN_COLUMNS)} FROM plans"
+                " WHERE destination_iata = ? AND source_iata = ? AND departure_date = ? AND return_date = ?"
+                " AND theme = ? AND num_days = ? AND budget_band = ? AND flight_class = ? AND hotel_rating = ?"
+                " AND visa_required = ? AND travel_insurance = ? AND preferences_norm = ? AND created_at >= ?"
+                " ORDER BY created_at DESC LIMIT 1",
+                (destination_iata, source_iata, str(departure_date), str(return_date), theme, int(num_days),
+                 budget_band(budget), flight_class, hotel_rating, int(bool(visa_required)),
+                 int(bool(travel_insurance)), normalize_preferences(preferences), min_created),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def mark_reused(self, plan_id: int):
+        """Đếm một lần kế hoạch được dùng lại (giữ nguyên created_at để hạn dùng lại không bị kéo dài)."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE plans SET reuse_count = reuse_count + 1 WHERE id = ?", (plan_id,))
+
+    def popular_trips(self, since_days: float = 30, limit: int = 20):
+        """Các tổ hợp chuyến + lựa chọn được yêu cầu nhiều nhất gần đây (tính cả lần dùng lại), nhiều nhất trước.
+
+        preferences/budget là giá trị của lần tạo gần nhất trong nhóm (cùng sở thích chuẩn hoá và nhóm
+        ngân sách), để cache_warmer dựng lại đúng prompt như UI.
+        """
+        # Với đúng một MAX() trong SELECT, SQLite lấy các cột không gộp từ dòng có created_at lớn nhất
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source_iata, destination_iata, destination_label, theme, num_days, flight_class,"
+                " hotel_rating, visa_required, travel_insurance, budget_band, preferences, budget,"
+                " COUNT(*) + SUM(reuse_count) AS requests, MAX(created_at) AS last_created_at"
+                " FROM plans WHERE created_at >= ?"
+                " GROUP BY source_iata, destination_iata, destination_label, theme, num_days, flight_class,"
+                " hotel_rating, visa_required, travel_insurance, budget_band, preferences_norm"
+                " ORDER BY requests DESC, last_created_at DESC LIMIT ?",
+                (time.time() - since_days * 86400, limit),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def prune(self, max_age_days: float):
+        """Xoá kế hoạch cũ hơn max_age_days. Trả về số bản ghi đã xoá."""
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM plans WHERE created_at < ?",
+                                     (time.time() - max_age_days * 86400,))
+            return cur.rowcount
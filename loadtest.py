@@ -0,0 +1,482 @@
+"""Kiểm thử tải cho app Streamlit (main.py) với SerpAPI/Gemini giả lập.
+
+Mỗi mức tải khởi động một server `streamlit run main.py` thật (backend giả lập được cài trong chính
+process server) rồi mở N phiên đồng thời qua websocket như trình duyệt: tải trang, nhập điểm đi/đến
+rồi bấm "Tạo kế hoạch du lịch". Kết quả (p50/p95/p99, tỉ lệ lỗi/fallback, CPU & RSS của process
+server) được ghi ra JSON để so sánh giữa các lần chạy:
+    python loadtest.py --stages 1,5,10,20 --iterations 3 --report loadtest_report.json
+Chạy thử app với backend giả lập bằng trình duyệt:
+    python loadtest.py --serve-stubbed 8501
+"""
+import argparse
+import datetime as _dt
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATE_LABEL = "Tạo kế hoạch du lịch"
+DEFAULT_ROUTES = ["TP.HCM, VN|Paris, FR", "Hà Nội, VN|Tokyo, JP", "TP.HCM, VN|Singapore, SG"]
+
+# ============== Backend giả lập ================================
+_STUB_FLIGHTS = {
+    "search_metadata": {"status": "Success"},
+    "best_flights": [
+        {
+            "price": 12000 + i * 1500,
+            "total_duration": 900 + i * 60,
+            "airline_logo": "",
+            "flights": [{
+                "airline": f"Stub Air {i}",
+                "departure_airport": {"id": "AAA", "time": "2025-01-01 08:00"},
+                "arrival_airport": {"id": "BBB", "time": "2025-01-01 22:00"},
+            }],
+        }
+        for i in range(4)
+    ],
+}
+
+class StubBackends:
+    """Thay GoogleSearch (utils) và các hàm tạo agent (agents.make_*) bằng bản giả có độ trễ/lỗi cấu hình được."""
+    def __init__(self, serp_latency=0.3, llm_latency=1.0, jitter=0.3, llm_error_rate=0.0, seed=None,
+                 counts_path=None):
+        self.serp_latency = serp_latency
+        self.llm_latency = llm_latency
+        self.jitter = jitter
+        self.llm_error_rate = llm_error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {"serpapi": 0, "llm": 0, "llm_errors": 0}
+        self.counts_path = counts_path  # server ghi số lần gọi ra file để harness (process khác) đọc
+
+    def _sleep(self, base):
+        with self._lock:
+            delay = base * (1 + self._rng.uniform(-self.jitter, self.jitter))
+        time.sleep(max(0.0, delay))
+
+    def _count(self, key):
+        with self._lock:
+            self.calls[key] += 1
+            if self.counts_path:
+                tmp = self.counts_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self.calls, f)
+                os.replace(tmp, self.counts_path)
+
+    def install(self):
+        import utils
+        import agents
+        backends = self
+
+        class _StubGoogleSearch:
+            def __init__(self, params):
+                self.params = params
+
+            def get_dict(self):
+                backends._count("serpapi")
+                backends._sleep(backends.serp_latency)
+                return json.loads(json.dumps(_STUB_FLIGHTS))
+
+        def _make_run(name):
+            def _run(prompt, stream=False, **kwargs):
+                backends._count("llm")
+                backends._sleep(backends.llm_latency)
+                with backends._lock:
+                    fail = backends._rng.random() < backends.llm_error_rate
+                if fail:
+                    backends._count("llm_errors")
+                    raise RuntimeError("429 Too Many Requests (stub)")
+                return SimpleNamespace(content=f"- [{name}] nội dung giả lập ({len(prompt)} ký tự prompt)")
+            return _run
+
+        def _make_factory(name):
+            return lambda: SimpleNamespace(name=name, run=_make_run(name))
+
+        utils.GoogleSearch = _StubGoogleSearch
+        agents.make_researcher = _make_factory(agents.RESEARCHER_NAME)
+        agents.make_planner = _make_factory(agents.PLANNER_NAME)
+        agents.make_hotel_restaurant_finder = _make_factory(agents.HOTEL_RESTAURANT_FINDER_NAME)
+
+# ============== Đo tài nguyên process server ===================
+def _proc_cpu_seconds(pid):
+    """CPU (user+sys) đã dùng của process pid, đọc từ /proc; None nếu không đọc được (vd: không phải Linux)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def _proc_rss_mb(pid):
+    """RSS hiện tại của process pid (MB); None nếu không đọc được."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class _ProcSampler(threading.Thread):
+    """Lấy mẫu RSS của process server định kỳ để có đỉnh bộ nhớ trong một mức tải."""
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = _proc_rss_mb(pid)
+        self._stop_evt = threading.Event()
+
+    def run(self):
+        while not self._stop_evt.wait(self.interval):
+            rss = _proc_rss_mb(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def stop(self):
+        self._stop_evt.set()
+        self.join()
+
+def percentile(values, pct):
+    """Percentile kiểu nearest-rank; None nếu danh sách rỗng."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+def _latency_summary(values_s):
+    ms = [v * 1000 for v in values_s]
+    if not ms:
+        return {"count": 0}
+    return {
+        "count": len(ms),
+        "mean": round(sum(ms) / len(ms), 1),
+        "p50": round(percentile(ms, 50), 1),
+        "p95": round(percentile(ms, 95), 1),
+        "p99": round(percentile(ms, 99), 1),
+        "max": round(max(ms), 1),
+    }
+
+# ============== Server streamlit với backend giả lập ===========
+def serve_stubbed(port, stub_kwargs=None, address="127.0.0.1"):
+    """Chạy `streamlit run main.py` trong chính process này sau khi cài backend giả lập (không trả về)."""
+    from streamlit.web import cli as stcli
+
+    os.chdir(APP_DIR)  # main.py đọc airports.csv theo đường dẫn tương đối
+    os.environ.setdefault("SERPAPI_API_KEY", "loadtest")
+    os.environ.setdefault("GOOGLE_API_KEY", "loadtest")
+    StubBackends(**(stub_kwargs or {})).install()
+    sys.argv = [
+        "streamlit", "run", os.path.join(APP_DIR, "main.py"),
+        "--server.port", str(port), "--server.address", address, "--server.headless", "true",
+        "--server.fileWatcherType", "none", "--server.runOnSave", "false",
+        "--browser.gatherUsageStats", "false",
+    ]
+    sys.exit(stcli.main())
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class StubbedServer:
+    """Process server streamlit (một cho mỗi mức tải) chạy qua `loadtest.py --serve-stubbed`."""
+    def __init__(self, stub_kwargs, work_dir, startup_timeout=60.0):
+        self.port = _free_port()
+        self.counts_path = os.path.join(work_dir, f"backend_calls_{self.port}.json")
+        self.log_path = os.path.join(work_dir, f"server_{self.port}.log")
+        self.stub_kwargs = stub_kwargs
+        self.startup_timeout = startup_timeout
+        self.proc = None
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def __enter__(self):
+        self._log = open(self.log_path, "w", encoding="utf-8")
+        cmd = [sys.executable, os.path.abspath(__file__), "--serve-stubbed", str(self.port),
+               "--counts-file", self.counts_path]
+        for key, value in self.stub_kwargs.items():
+            if value is not None:
+                cmd += ["--" + key.replace("_", "-"), str(value)]
+        self.proc = subprocess.Popen(cmd, cwd=APP_DIR, stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + self.startup_timeout
+        health = f"http://127.0.0.1:{self.port}/_stcore/health"
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"Server streamlit dừng khi khởi động, xem {self.log_path}")
+            try:
+                with urllib.request.urlopen(health, timeout=2) as resp:
+                    if resp.status == 200:
+                        return self
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                self.__exit__(None, None, None)
+                raise RuntimeError(f"Server streamlit không sẵn sàng sau {self.startup_timeout:g}s")
+            time.sleep(0.2)
+
+    def __exit__(self, *exc):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self._log.close()
+
+    def backend_calls(self):
+        try:
+            with open(self.counts_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"serpapi": 0, "llm": 0, "llm_errors": 0}
+
+# ============== Một phiên mô phỏng (client websocket) ==========
+class _BrowserSession:
+    """Một tab trình duyệt tối giản: gửi BackMsg rerun_script và gom element của lần chạy script."""
+    def __init__(self, url, timeout):
+        from websockets.sync.client import connect
+
+        self.timeout = timeout
+        self.ws = connect(url, subprotocols=["streamlit"], max_size=None, open_timeout=timeout)
+
+    def close(self):
+        self.ws.close()
+
+    def run(self, widget_states=()):
+        """Chạy lại script với trạng thái widget cho trước; trả về [(loại element, proto)] theo thứ tự."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.widget_states.widgets.extend(widget_states)
+        self.ws.send(msg.SerializeToString())
+
+        elements = []
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Script chạy quá {self.timeout:g}s")
+            fwd = ForwardMsg()
+            fwd.ParseFromString(self.ws.recv(timeout=remaining))
+            kind = fwd.WhichOneof("type")
+            if kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                el = fwd.delta.new_element
+                elements.append((el.WhichOneof("type"), el))
+            elif kind == "script_finished":
+                if fwd.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("Script lỗi biên dịch")
+                return elements
+
+def _widget(elements, kind, label_prefix):
+    return next((getattr(el, k) for k, el in elements
+                 if k == kind and getattr(el, k).label.startswith(label_prefix)), None)
+
+def _alerts(elements, fmt):
+    from streamlit.proto.Alert_pb2 import Alert
+
+    code = Alert.Format.Value(fmt)
+    return [el.alert.body for k, el in elements if k == "alert" and el.alert.format == code]
+
+def run_session(url, route, timeout, allow_reuse=False):
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    origin, destination = route.split("|", 1)
+    result = {"route": route, "ok": False, "error": None, "fallback": False, "retry_warnings": 0}
+    started = time.perf_counter()
+    session = None
+    try:
+        session = _BrowserSession(url, timeout)
+        elements = session.run()
+        states = []
+        for label, value in (("Thành phố khởi hành", origin), ("Điểm đến", destination)):
+            widget = _widget(elements, "text_input", label)
+            if widget is not None:
+                states.append(WidgetState(id=widget.id, string_value=value))
+        reuse = _widget(elements, "checkbox", "Dùng lại kế hoạch")
+        if reuse is not None and not allow_reuse:
+            states.append(WidgetState(id=reuse.id, bool_value=False))
+        elements = session.run(states)
+        result["load_s"] = time.perf_counter() - started
+
+        button = _widget(elements, "button", GENERATE_LABEL)
+        if button is None or button.disabled:
+            raise RuntimeError("Nút tạo kế hoạch không dùng được (không tìm thấy sân bay?)")
+        plan_started = time.perf_counter()
+        elements = session.run(states + [WidgetState(id=button.id, trigger_value=True)])
+        result["plan_s"] = time.perf_counter() - plan_started
+
+        exceptions = [el.exception.message for k, el in elements if k == "exception"]
+        if exceptions:
+            raise RuntimeError(exceptions[0])
+        warnings = _alerts(elements, "WARNING")
+        result["retry_warnings"] = sum(1 for w in warnings if "quá tải" in w)
+        result["fallback"] = any("[FALLBACK" in el.markdown.body for k, el in elements if k == "markdown")
+        # "... lỗi liên tục" là fallback của safe_agent_run, không tính là lỗi phiên
+        real_errors = [e for e in _alerts(elements, "ERROR") if "lỗi liên tục" not in e]
+        if real_errors:
+            raise RuntimeError("; ".join(real_errors))
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if session is not None:
+            session.close()
+    result["total_s"] = time.perf_counter() - started
+    return result
+
+# ============== Các mức tải ====================================
+def run_stage(concurrency, iterations, routes, timeout, allow_reuse, stub_kwargs, work_dir):
+    n_sessions = concurrency * iterations
+    with StubbedServer(stub_kwargs, work_dir) as server:
+        # một phiên làm nóng (nạp airports.csv, import module) không tính vào kết quả
+        warmup = run_session(server.url, routes[0], timeout, allow_reuse)
+        calls_before = server.backend_calls()
+        cpu_before = _proc_cpu_seconds(server.proc.pid)
+        rss_start = _proc_rss_mb(server.proc.pid)
+        sampler = _ProcSampler(server.proc.pid)
+        sampler.start()
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(
+                lambda i: run_session(server.url, routes[i % len(routes)], timeout, allow_reuse),
+                range(n_sessions),
+            ))
+        wall = time.perf_counter() - wall_start
+
+        sampler.stop()
+        cpu_after = _proc_cpu_seconds(server.proc.pid)
+        calls_after = server.backend_calls()
+
+    ok = [r for r in results if r["ok"]]
+    errors = [r for r in results if not r["ok"]]
+    n_fallback = sum(1 for r in ok if r["fallback"])
+    server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "concurrency": concurrency,
+        "sessions": n_sessions,
+        "wall_s": round(wall, 3),
+        "throughput_sessions_per_s": round(n_sessions / wall, 3) if wall else None,
+        "latency_ms": {
+            "page_load": _latency_summary([r["load_s"] for r in ok]),
+            "plan": _latency_summary([r["plan_s"] for r in ok]),
+            "total": _latency_summary([r["total_s"] for r in results]),
+        },
+        "error_rate": round(len(errors) / n_sessions, 4),
+        # fallback chỉ xác định được ở phiên chạy xong -> tính trên số phiên thành công, kèm tỉ lệ trên tổng
+        "fallback_rate": round(n_fallback / len(ok), 4) if ok else None,
+        "fallback_rate_of_all": round(n_fallback / n_sessions, 4),
+        "retry_warnings_per_session": round(sum(r["retry_warnings"] for r in results) / n_sessions, 3),
+        "server": {
+            "cpu_s": round(server_cpu, 3) if server_cpu is not None else None,
+            "cpu_utilization": round(server_cpu / wall, 3) if server_cpu is not None and wall else None,
+            "cpu_s_per_session": round(server_cpu / n_sessions, 4) if server_cpu is not None else None,
+            "rss_start_mb": round(rss_start, 1) if rss_start is not None else None,
+            "rss_peak_mb": round(sampler.peak, 1) if sampler.peak is not None else None,
+        },
+        "backend_calls": {k: v - calls_before.get(k, 0) for k, v in calls_after.items()},
+        "warmup_error": warmup["error"],
+        "sample_errors": sorted({r["error"] for r in errors})[:5],
+    }
+
+MEASUREMENT_NOTES = (
+    "Mỗi mức tải dùng một server `streamlit run main.py` mới (backend giả lập cài trong process server), "
+    "làm nóng bằng một phiên không tính, rồi mở đồng thời `concurrency` phiên websocket như trình duyệt. "
+    "Các phiên chạy cùng nhau trong một process nên tranh chấp GIL/CPU, sleep của retry và lock là thật. "
+    "server.cpu_s/rss_*: chỉ của process server (không gồm client trong harness); cpu_s_per_session = "
+    "tổng CPU server trong mức tải chia số phiên, không phải đo riêng từng phiên; cpu_utilization = "
+    "cpu_s / wall_s (1.0 = một lõi). Đo CPU/RSS cần /proc (Linux)."
+)
+
+def run_load_test(stages, iterations=2, routes=None, timeout=120.0, allow_reuse=False, stub_kwargs=None):
+    routes = routes or DEFAULT_ROUTES
+    stub_kwargs = dict(stub_kwargs or {})
+    tmp_dir = tempfile.mkdtemp(prefix="loadtest_")
+
+    # Server thừa hưởng os.environ: khoá giả để config.py import được; kho kế hoạch và cache phản hồi luôn
+    # nằm trong thư mục tạm (kết quả giả không lọt vào file thật); không có --allow-reuse thì tắt cache
+    # phản hồi để đo đúng đường gọi backend.
+    os.environ.setdefault("SERPAPI_API_KEY", "loadtest")
+    os.environ.setdefault("GOOGLE_API_KEY", "loadtest")
+    os.environ["ITINERARY_DB_PATH"] = os.path.join(tmp_dir, "itineraries.db")
+    os.environ["RESPONSE_CACHE_PATH"] = os.path.join(tmp_dir, "response_cache.db") if allow_reuse else ""
+
+    defaults = StubBackends(**stub_kwargs)
+    report = {
+        "started_at": _dt.datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "app": "main.py",
+            "stages": stages,
+            "iterations": iterations,
+            "routes": routes,
+            "timeout_s": timeout,
+            "allow_reuse": allow_reuse,
+            "stubs": {k: getattr(defaults, k) for k in ("serp_latency", "llm_latency", "jitter", "llm_error_rate")},
+            "seed": stub_kwargs.get("seed"),
+            "python": sys.version.split()[0],
+            "cpu_count": os.cpu_count(),
+        },
+        "measurement_notes": MEASUREMENT_NOTES,
+        "stages": [],
+    }
+    for concurrency in stages:
+        print(f"[⏱️] Mức tải: {concurrency} phiên đồng thời x {iterations} lượt...", file=sys.stderr, flush=True)
+        stage = run_stage(concurrency, iterations, routes, timeout, allow_reuse, stub_kwargs, tmp_dir)
+        report["stages"].append(stage)
+        plan = stage["latency_ms"]["plan"]
+        print(f"    p50={plan.get('p50')}ms p95={plan.get('p95')}ms p99={plan.get('p99')}ms "
+              f"lỗi={stage['error_rate']:.1%} fallback={stage['fallback_rate_of_all']:.1%} "
+              f"cpu server={stage['server']['cpu_utilization']}", file=sys.stderr, flush=True)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kiểm thử tải app Streamlit với backend giả lập.")
+    parser.add_argument("--stages", default="1,5,10", help="Các mức phiên đồng thời, cách nhau bởi dấu phẩy")
+    parser.add_argument("--iterations", type=int, default=2, help="Số lượt phiên cho mỗi slot đồng thời ở mỗi mức tải")
+    parser.add_argument("--route", action="append", dest="routes",
+                        help="Cặp 'Điểm đi|Điểm đến' (lặp lại được); mặc định dùng vài tuyến phổ biến")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Timeout mỗi lần chạy script (giây)")
+    parser.add_argument("--serp-latency", type=float, default=0.3, help="Độ trễ giả lập SerpAPI (giây)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Độ trễ giả lập mỗi lần gọi Gemini (giây)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Dao động độ trễ (tỉ lệ, 0.3 = ±30%%)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Tỉ lệ lỗi 429 giả lập của Gemini")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--allow-reuse", action="store_true",
+                        help="Cho phép dùng lại kế hoạch đã lưu và cache phản hồi SerpAPI/Gemini (cả hai đều là file tạm của lần chạy)")
+    parser.add_argument("--report", default="loadtest_report.json", help="File JSON kết quả")
+    parser.add_argument("--serve-stubbed", type=int, metavar="PORT",
+                        help="Chỉ chạy server streamlit với backend giả lập trên cổng PORT (để thử bằng trình duyệt)")
+    parser.add_argument("--counts-file", help=argparse.SUPPRESS)  # server ghi số lần gọi backend cho harness
+    args = parser.parse_args(argv)
+
+    stub_kwargs = {"serp_latency": args.serp_latency, "llm_latency": args.llm_latency,
+                   "jitter": args.jitter, "llm_error_rate": args.llm_error_rate, "seed": args.seed}
+    if args.serve_stubbed:
+        serve_stubbed(args.serve_stubbed, {**stub_kwargs, "counts_path": args.counts_file})
+    stages = [int(s) for s in args.stages.split(",") if s.strip()]
+    report = run_load_test(
+        stages, iterations=args.iterations, routes=args.routes, timeout=args.timeout,
+        allow_reuse=args.allow_reuse, stub_kwargs=stub_kwargs,
+    )
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[✅] Đã ghi báo cáo: {args.report}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,15 @@
 import streamlit as st
-import json
 import os
 import re
-import unicodedata
 import pandas as pd
-from csv import Sniffer
-import time
 import traceback
-import datetime as _dt
 
-from config import SERPAPI_KEY
-from utils import format_datetime, fetch_flights, extract_cheapest_flights
-from agents import researcher, planner, hotel_restaurant_finder
+from config import SERPAPI_KEY, ITINERARY_DB_PATH, ITINERARY_MAX_AGE_DAYS, ITINERARY_RETENTION_DAYS
+from utils import format_datetime
 from email_utils import send_itinerary_email
+from airport_utils import load_airports as _load_airports_csv, find_iata_options
+from trip_planner import plan_trip
+from itinerary_store import ItineraryStore
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -73,175 +70,15 @@ def linkify(text: str, html: bool = True) -> str:
     else:
         return _URL_RE.sub(r'[\1](\1)', text)
 
-# ============== Retry cho agent (chống 429) ====================
-def safe_agent_run(agent, prompt: str, retries: int = 3, base_wait: float = 4.0, component_name: str = "agent"):
-    for i in range(retries):
-        try:
-            return agent.run(prompt, stream=False)
-        except Exception as e:
-            msg = str(e)
-            is_rate = ("429" in msg) or ("Too Many Requests" in msg)
-            wait = base_wait * (2 ** i) if is_rate else base_wait
-            st.warning(f"⚠️ {component_name} đang quá tải (thử {i+1}/{retries}). Sẽ thử lại sau {wait:.0f}s.")
-            time.sleep(wait)
-    st.error(f"❌ {component_name} lỗi liên tục. Dùng nội dung tạm thời để không gián đoạn.")
-    class _Resp:
-        def __init__(self, content): self.content = content
-    fb = f"[FALLBACK - {component_name}] Model đang quá tải hoặc giới hạn lượt gọi. Vui lòng thử lại sau."
-    return _Resp(fb)
-
-# ============== Flights fallback helpers =======================
-def _fallback_pick_flights(flight_data, limit=6):
-    if not isinstance(flight_data, dict):
-        return []
-    best = flight_data.get("best_flights") or []
-    other = flight_data.get("other_flights") or []
-    pool = (best + other)[:limit]
-
-    normalized = []
-    for f in pool:
-        price = f.get("price") or f.get("total_price") or "N/A"
-        duration = f.get("total_duration") or f.get("duration") or "N/A"
-        flights_info = f.get("flights") or f.get("segments") or []
-        airline_logo = f.get("airline_logo") or f.get("logo") or ""
-        airline = f.get("airline") or (flights_info[0].get("airline") if flights_info else "Không xác định")
-        normalized.append({
-            "airline_logo": airline_logo,
-            "airline": airline,
-            "price": price,
-            "total_duration": duration,
-            "flights": flights_info,
-            "departure_token": f.get("departure_token", ""),
-            "link": f.get("link"),
-            "booking_options": f.get("booking_options"),
-        })
-    return normalized
-
 # ============== City/Country (text) -> IATA từ CSV =============
-def _normalize_text(s: str) -> str:
-    if not isinstance(s, str):
-        return ""
-    s = s.strip().lower()
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    s = " ".join(s.split())
-    return s
-
-CITY_ALIASES = {
-    "tp hcm": "ho chi minh",
-    "tphcm": "ho chi minh",
-    "hcm": "ho chi minh",
-    "sai gon": "ho chi minh",
-    "saigon": "ho chi minh",
-    "tp ho chi minh": "ho chi minh",
-    "ha noi": "soc son",
-    "hn": "soc son",
-    "hanoi": "soc son",
-}
-
-COUNTRY_TO_ISO2 = {
-    "vn": "vn", "viet nam": "vn", "vietnam": "vn",
-    "fr": "fr", "france": "fr",
-    "us": "us", "usa": "us", "united states": "us", "united states of america": "us",
-    "uk": "gb", "gb": "gb", "great britain": "gb", "united kingdom": "gb",
-    "jp": "jp", "japan": "jp",
-    "kr": "kr", "south korea": "kr", "korea": "kr",
-    "de": "de", "germany": "de",
-    "it": "it", "italy": "it",
-    "es": "es", "spain": "es",
-    "au": "au", "australia": "au",
-    "ca": "ca", "canada": "ca",
-    "cn": "cn", "china": "cn",
-    "sg": "sg", "singapore": "sg",
-    "th": "th", "thailand": "th",
-    "my": "my", "malaysia": "my",
-    "id": "id", "indonesia": "id",
-    "ph": "ph", "philippines": "ph",
-    "tw": "tw", "taiwan": "tw",
-    "hk": "hk", "hong kong": "hk",
-    "ru": "ru", "russia": "ru",
-    "br": "br", "brazil": "br",
-    "mx": "mx", "mexico": "mx",
-    "ae": "ae", "uae": "ae", "united arab emirates": "ae",
-}
-
 @st.cache_data(show_spinner=False)
 def load_airports(csv_path: str = "airports.csv") -> pd.DataFrame:
-    with open(csv_path, "r", encoding="utf-8", errors="ignore") as f:
-        sample = f.read(4096)
-        try:
-            sep = Sniffer().sniff(sample).delimiter
-        except Exception:
-            sep = ","
-    df = pd.read_csv(csv_path, sep=sep, dtype=str, encoding="utf-8", engine="python")
-
-    required = ["code", "name", "country", "city", "state"]
-    for c in required:
-        if c not in df.columns:
-            raise ValueError(f"Thiếu cột {c} trong CSV (cần: {', '.join(required)})")
-
-    for c in ["code", "name", "country", "city", "state"]:
-        df[c] = df[c].fillna("").astype(str).str.strip()
-
-    df = df[df["code"].str.len() == 3].copy()
-
-    df["n_city"]  = df["city"].map(_normalize_text)
-    df["n_state"] = df["state"].map(_normalize_text)
-    df["n_name"]  = df["name"].map(_normalize_text)
-    df["n_ctry"]  = df["country"].map(_normalize_text)
-
-    df["n_city_slim"]  = df["n_city"].str.replace(r"\bcity\b", "", regex=True).str.strip()
-    df["n_state_slim"] = df["n_state"].str.replace(r"\bcity\b", "", regex=True).str.strip()
-
-    return df[["code","name","country","city","state","n_city","n_state","n_name","n_ctry","n_city_slim","n_state_slim"]]
-
-def _split_city_country(q: str):
-    parts = [p.strip() for p in (q or "").split(",")]
-    city_inp = _normalize_text(parts[0] if parts else "")
-    ctry_inp = _normalize_text(parts[1] if len(parts) > 1 else "")
-
-    city_inp = CITY_ALIASES.get(city_inp, city_inp)
-    if ctry_inp:
-        ctry_inp = COUNTRY_TO_ISO2.get(ctry_inp, ctry_inp)
-    return city_inp, ctry_inp
-
-def find_iata_options(query: str, airports_df: pd.DataFrame, max_preview: int = 40):
-    city_q, ctry_q = _split_city_country(query)
-    if not city_q:
-        return [], pd.DataFrame()
-
-    cand = airports_df[
-        (airports_df["n_city"] == city_q) |
-        (airports_df["n_city_slim"] == city_q) |
-        (airports_df["n_state"] == city_q) |
-        (airports_df["n_state_slim"] == city_q)
-    ].copy()
-
-    if cand.empty:
-        cand = airports_df[
-            airports_df["n_city"].str.contains(city_q, na=False) |
-            airports_df["n_city_slim"].str.contains(city_q, na=False) |
-            airports_df["n_state"].str.contains(city_q, na=False) |
-            airports_df["n_state_slim"].str.contains(city_q, na=False) |
-            airports_df["n_name"].str.contains(city_q, na=False)
-        ].copy()
-
-    if ctry_q and not cand.empty:
-        cand = cand[cand["n_ctry"] == ctry_q]
-
-    options, seen = [], set()
-    for _, r in cand.iterrows():
-        code = r["code"]
-        if code in seen:
-            continue
-        seen.add(code)
-        label_loc = r["city"] or r["state"]
-        label = f"{code} — {r['name']} ({label_loc}, {r['country']})"
-        options.append((label, code))
+    return _load_airports_csv(csv_path)
 
-    preview = cand.head(max_preview)[["code","name","city","state","country"]]
-    return options, preview
+# ============== Kho kế hoạch đã lưu (SQLite) ===================
+@st.cache_resource(show_spinner=False)
+def get_itinerary_store() -> ItineraryStore:
+    return ItineraryStore(ITINERARY_DB_PATH, retention_days=ITINERARY_RETENTION_DAYS)
 
 # ============================ UI ================================
 st.set_page_config(page_title="🌍 Trợ lý du lịch AI", layout="wide")
@@ -337,6 +174,10 @@ st.sidebar.subheader("Cá nhân hóa chuyến đi")
 budget = st.sidebar.number_input("Ngân sách mong muốn (USD):", min_value=100.0, max_value=10000.0, step=50.0, value=1000.0)
 flight_class = st.sidebar.radio("Hạng vé máy bay:", ["Phổ thông", "Thương gia", "Hạng nhất"])
 hotel_rating = st.sidebar.selectbox("Xếp hạng khách sạn mong muốn:", ["Bất kỳ", "3⭐", "4⭐", "5⭐"])
+reuse_recent = st.sidebar.checkbox(
+    f"Dùng lại kế hoạch đã tạo cho cùng chuyến & lựa chọn trong {ITINERARY_MAX_AGE_DAYS:g} ngày gần đây (tức thì)",
+    value=True,
+)
 
 # st.sidebar.subheader("Danh sách cần mang theo")
 # packing_list = {
@@ -380,107 +221,28 @@ if st.button("Tạo kế hoạch du lịch", disabled=btn_disabled):
             st.error("Vui lòng chọn sân bay khởi hành và đến hợp lệ.")
             st.stop()
 
-        with st.spinner("Đang tìm chuyến bay tốt nhất..."):
-            data_main = fetch_flights(source, destination, departure_date, return_date)
-
-            cheapest_flights = []
-            try:
-                cheapest_flights = extract_cheapest_flights(data_main) or []
-            except Exception as e:
-                st.warning(f"extract_cheapest_flights lỗi: {e}")
-
-            if not cheapest_flights:
-                cheapest_flights = _fallback_pick_flights(data_main)
-
-            if not cheapest_flights:
-                try_dates = []
-                try:
-                    d0 = _dt.date.fromisoformat(str(departure_date))
-                    r0 = _dt.date.fromisoformat(str(return_date))
-                    try_dates = [
-                        (d0, r0),
-                        (d0 + _dt.timedelta(days=1), r0 + _dt.timedelta(days=1)),
-                        (d0 - _dt.timedelta(days=1), r0 - _dt.timedelta(days=1)),
-                    ]
-                except Exception:
-                    try_dates = []
-
-                for d, r in try_dates[1:]:
-                    data_try = fetch_flights(source, destination, d, r)
-                    cf = []
-                    try:
-                        cf = extract_cheapest_flights(data_try) or []
-                    except:
-                        pass
-                    if not cf:
-                        cf = _fallback_pick_flights(data_try)
-                    if cf:
-                        st.info(f"Không thấy kết quả ngày chính xác. Đã dùng khoảng ngày: {d} → {r}.")
-                        cheapest_flights = cf
-                        break
+        itinerary_store = None
+        try:
+            itinerary_store = get_itinerary_store()
+        except Exception as e:
+            st.caption(f"Không mở được kho kế hoạch đã lưu: {e}")
+
+        plan = plan_trip(
+            source, destination, destination_city_input, departure_date, return_date, num_days, travel_theme,
+            activity_preferences, budget, flight_class=flight_class, hotel_rating=hotel_rating,
+            visa_required=visa_required, travel_insurance=travel_insurance,
+            on_info=st.info, on_warning=st.warning, on_error=st.error, step=st.spinner,
+            store=itinerary_store, reuse_max_age_days=ITINERARY_MAX_AGE_DAYS if reuse_recent else 0,
+            refresh=not reuse_recent,  # bỏ chọn = tạo mới hoàn toàn, không lấy cả cache phản hồi
+        )
+        cheapest_flights = plan["flights"]
+        data_main = plan["flight_data"]
 
         if not cheapest_flights:
             st.warning("SerpAPI không trả chuyến bay phù hợp. Hiển thị phản hồi gốc để kiểm tra:")
             if isinstance(data_main, dict):
                 st.json({k: data_main.get(k) for k in ["search_metadata", "error", "best_flights", "other_flights"]})
 
-        # ---------- Research: TRẢ VỀ VĂN BẢN THUẦN ----------
-        with st.spinner("Đang tìm điểm đến & hoạt động nổi bật..."):
-            research_prompt = f"""
-Bạn là Travel Researcher.
-Điểm đến: {destination_city_input}.
-Sở thích: {activity_preferences}. Chủ đề: {travel_theme}. Số ngày: {num_days}.
-
-HÃY TRẢ VỀ VĂN BẢN THUẦN (KHÔNG MARKDOWN, KHÔNG BẢNG, KHÔNG TIÊU ĐỀ).
-Chỉ liệt kê theo dạng gạch đầu dòng, ngắn gọn, mỗi mục một dòng.
-
-Bao gồm:
-- Tổng quan nhanh: khí hậu theo mùa, lưu ý an toàn, tips di chuyển nội đô.
-- Danh sách 8–12 hoạt động phù hợp với "{travel_theme}" trong {num_days} ngày.
-- Mỗi hoạt động: tên + mô tả ngắn + khung giờ gợi ý (sáng/chiều/tối) + chi phí ước tính nếu có.
-Ngôn ngữ: tiếng Việt.
-            """.strip()
-            research_results = safe_agent_run(
-                researcher, research_prompt, retries=3, base_wait=4.0,
-                component_name="Nghiên cứu điểm đến"
-            )
-
-        # ---------- Hotels & Restaurants: VĂN BẢN THUẦN ----------
-        with st.spinner("Đang tìm khách sạn & nhà hàng..."):
-            hotel_restaurant_prompt = f"""
-Bạn là Hotel & Restaurant Finder cho {destination_city_input}.
-Ngân sách ~{int(budget)} USD. Hạng khách sạn mong muốn: {hotel_rating}.
-Sở thích: {activity_preferences}. Hành trình: {num_days} ngày. Chủ đề: {travel_theme}.
-
-HÃY TRẢ VỀ VĂN BẢN THUẦN (KHÔNG MARKDOWN, KHÔNG BẢNG).
-Chỉ liệt kê danh sách gạch đầu dòng, mỗi dòng 1 mục đầy đủ thông tin.
-Chia phần 1 và phần 2 cho dễ nhìn. 
-
-Phần 1 - Khách sạn (8–12 gợi ý):
-- Tên khách sạn | Khu vực gần landmark | Hạng sao | Điểm đánh giá | Giá ước tính/đêm (USD) | Chính sách huỷ | Link đặt phòng (có chưa URL đầy đủ, đưa thẳng đến website, có chưa https://)
-
-Phần 2 - Nhà hàng/quán ăn (10–15 gợi ý, đủ sáng/trưa/tối, nhiều mức giá):
-- Tên | Loại ẩm thực | Khu vực | Mức giá/người (USD) | Có đặt bàn không | Link Maps/Website Link đặt phòng (có chưa URL đầy đủ, đưa thẳng đến website, có chưa https://)
-
-Ưu tiên vị trí thuận tiện và chỗ đáng tin cậy. Ngôn ngữ: tiếng Việt.
-            """.strip()
-            hotel_restaurant_results = safe_agent_run(
-                hotel_restaurant_finder, hotel_restaurant_prompt, retries=3, base_wait=4.0,
-                component_name="Khách sạn & Nhà hàng"
-            )
-
-        with st.spinner("Đang tạo lịch trình cá nhân hóa..."):
-            planning_prompt = (
-                f"Dựa trên dữ liệu sau, hãy tạo lịch trình {num_days} ngày cho chuyến đi {travel_theme.lower()} đến {destination_city_input}. "
-                f"Khách du lịch thích: {activity_preferences}. Ngân sách: khoảng {int(budget)} USD. Hạng vé: {flight_class}. Khách sạn: {hotel_rating}. "
-                f"Visa: {visa_required}. Bảo hiểm: {travel_insurance}. Nghiên cứu: {research_results.content}. "
-                f"Chuyến bay: {json.dumps(cheapest_flights, ensure_ascii=False)}. Khách sạn & Nhà hàng: {hotel_restaurant_results.content}."
-            )
-            itinerary = safe_agent_run(
-                planner, planning_prompt, retries=3, base_wait=4.0,
-                component_name="Lập lịch trình"
-            )
-
         # ========== Render ==========
         st.subheader("Các chuyến bay giá tốt nhất")
         if cheapest_flights:
@@ -540,20 +302,20 @@ Phần 2 - Nhà hàng/quán ăn (10–15 gợi ý, đủ sáng/trưa/tối, nhi
 
         # Hai phần sau hiển thị VĂN BẢN THUẦN đã linkify, dùng Markdown để có link bấm được
         st.subheader("Điểm đến & hoạt động nổi bật ")
-        research_plain = to_plain_list(research_results.content)
+        research_plain = to_plain_list(plan["research"])
         st.markdown(linkify(research_plain, html=True).replace("\n", "  \n"), unsafe_allow_html=True)
 
         st.subheader("Khách sạn & Nhà hàng ")
-        hotels_plain = to_plain_list(hotel_restaurant_results.content)
+        hotels_plain = to_plain_list(plan["hotels_restaurants"])
         st.markdown(linkify(hotels_plain, html=True).replace("\n", "  \n"), unsafe_allow_html=True)
 
         st.subheader("Lịch trình cá nhân hóa của bạn")
-        st.write(itinerary.content)
+        st.write(plan["itinerary"])
 
         st.success("Kế hoạch du lịch đã được tạo thành công!")
 
-        st.session_state.itinerary = itinerary.content
-        st.session_state.hotel_restaurant_results = hotel_restaurant_results.content
+        st.session_state.itinerary = plan["itinerary"]
+        st.session_state.hotel_restaurant_results = plan["hotels_restaurants"]
 
     except Exception:
         st.error("Đã xảy ra lỗi không mong muốn khi tạo kế hoạch.")
@@ -0,0 +1,98 @@
+"""Cache phản hồi SerpAPI/Gemini có hạn dùng (TTL), lưu trong SQLite để dùng chung giữa các phiên/process."""
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    namespace  TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    value_json TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at);
+"""
+
+# Xác suất mỗi lần set() dọn luôn các mục đã hết hạn, để file cache không phình mãi
+PURGE_PROBABILITY = 0.01
+
+class CacheMiss(LookupError):
+    """Không có mục còn hạn trong cache khi được yêu cầu chỉ đọc cache (cache_only=True)."""
+
+def make_key(*parts) -> str:
+    """Khoá cache ổn định (sha256) từ các thành phần đầu vào."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Cache key -> giá trị JSON theo namespace ("flights", "agent"), an toàn khi dùng nhiều thread."""
+    def __init__(self, db_path: str = "response_cache.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, namespace: str, key: str):
+        """Giá trị còn hạn, hoặc None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value_json FROM responses WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value, ttl_seconds: float):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (namespace, key, value_json, created_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False, default=str), now, now + ttl_seconds),
+            )
+            if random.random() < PURGE_PROBABILITY:
+                self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+
+    def expires_in(self, namespace: str, key: str):
+        """Số giây còn lại trước khi hết hạn; None nếu không có hoặc đã hết hạn."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at FROM responses WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if not row:
+            return None
+        remaining = row[0] - time.time()
+        return remaining if remaining > 0 else None
+
+    def purge_expired(self) -> int:
+        """Xoá các mục đã hết hạn. Trả về số bản ghi đã xoá."""
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),)).rowcount
+
+# Cache mặc định theo config (RESPONSE_CACHE_PATH rỗng = tắt); tạo lại sau fork để không dùng chung kết nối
+_default_cache = None
+_default_pid = None
+_default_lock = threading.Lock()
+
+def get_default_cache():
+    global _default_cache, _default_pid
+    from config import RESPONSE_CACHE_PATH
+    if not RESPONSE_CACHE_PATH:
+        return None
+    with _default_lock:
+        if _default_cache is None or _default_pid != os.getpid():
+            _default_cache = ResponseCache(RESPONSE_CACHE_PATH)
+            _default_pid = os.getpid()
+        return _default_cache
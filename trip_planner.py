@@ -0,0 +1,312 @@
+import contextlib
+import json
+import time
+import datetime as _dt
+
+from config import AGENT_CACHE_TTL_HOURS
+from utils import fetch_flights, extract_cheapest_flights, throttle
+import agents
+from response_cache import CacheMiss, get_default_cache, make_key
+
+# Giá trị mặc định (giống sidebar của main.py) cho các yêu cầu không ghi rõ, dùng bởi batch_plan/cache_warmer
+DEFAULT_REQUEST = {
+    "num_days": 5,
+    "theme": "Du lịch cặp đôi",
+    "preferences": "Nghỉ dưỡng, khám phá di tích lịch sử",
+    "budget": 1000.0,
+    "flight_class": "Phổ thông",
+    "hotel_rating": "Bất kỳ",
+}
+
+# ============== Retry cho agent (chống 429) ====================
+class FallbackResponse:
+    """Nội dung tạm thời khi agent lỗi liên tục (giống response của agno: có .content)."""
+    def __init__(self, content):
+        self.content = content
+
+class StoredResponse:
+    """Nội dung lấy lại từ cache phản hồi hoặc kho kế hoạch đã lưu, cũng có .content."""
+    def __init__(self, content):
+        self.content = content
+
+def _print_notice(msg: str):
+    print(msg, flush=True)
+
+def agent_cache_key(agent_name, prompt: str) -> str:
+    return make_key(agent_name, prompt)
+
+def safe_agent_run(agent, prompt: str, retries: int = 3, base_wait: float = 4.0, component_name: str = "agent",
+                   on_retry=None, on_fail=None, refresh=False, cache_only=False):
+    """Gọi agent.run có cache + retry/backoff. on_retry/on_fail nhận thông báo (mặc định in ra stdout).
+
+    refresh=True bỏ qua cache và ghi đè kết quả mới (dùng cho cache_warmer). Nội dung fallback không được cache.
+    cache_only=True: không gọi agent, ném CacheMiss nếu cache không có câu trả lời còn hạn.
+    """
+    on_retry = on_retry or _print_notice
+    on_fail = on_fail or _print_notice
+    cache = get_default_cache()
+    key = agent_cache_key(getattr(agent, "name", None), prompt)
+    if cache is not None and not refresh:
+        cached = cache.get("agent", key)
+        if cached is not None:
+            return StoredResponse(cached)
+    if cache_only:
+        raise CacheMiss(f"agent {component_name}")
+
+    for i in range(retries):
+        throttle("llm")
+        try:
+            resp = agent.run(prompt, stream=False)
+        except Exception as e:
+            msg = str(e)
+            is_rate = ("429" in msg) or ("Too Many Requests" in msg)
+            wait = base_wait * (2 ** i) if is_rate else base_wait
+            on_retry(f"⚠️ {component_name} đang quá tải (thử {i+1}/{retries}). Sẽ thử lại sau {wait:.0f}s.")
+            time.sleep(wait)
+            continue
+        if cache is not None and isinstance(getattr(resp, "content", None), str):
+            cache.set("agent", key, resp.content, AGENT_CACHE_TTL_HOURS * 3600)
+        return resp
+    on_fail(f"❌ {component_name} lỗi liên tục. Dùng nội dung tạm thời để không gián đoạn.")
+    fb = f"[FALLBACK - {component_name}] Model đang quá tải hoặc giới hạn lượt gọi. Vui lòng thử lại sau."
+    return FallbackResponse(fb)
+
+# ============== Flights fallback helpers =======================
+def _fallback_pick_flights(flight_data, limit=6):
+    if not isinstance(flight_data, dict):
+        return []
+    best = flight_data.get("best_flights") or []
+    other = flight_data.get("other_flights") or []
+    pool = (best + other)[:limit]
+
+    normalized = []
+    for f in pool:
+        price = f.get("price") or f.get("total_price") or "N/A"
+        duration = f.get("total_duration") or f.get("duration") or "N/A"
+        flights_info = f.get("flights") or f.get("segments") or []
+        airline_logo = f.get("airline_logo") or f.get("logo") or ""
+        airline = f.get("airline") or (flights_info[0].get("airline") if flights_info else "Không xác định")
+        normalized.append({
+            "airline_logo": airline_logo,
+            "airline": airline,
+            "price": price,
+            "total_duration": duration,
+            "flights": flights_info,
+            "departure_token": f.get("departure_token", ""),
+            "link": f.get("link"),
+            "booking_options": f.get("booking_options"),
+        })
+    return normalized
+
+def search_flights(source, destination, departure_date, return_date, on_info=None, on_warning=None,
+                   refresh=False, cache_only=False):
+    """Tìm chuyến bay rẻ nhất; nếu trống thì thử lệch ±1 ngày. Trả về (cheapest_flights, data_main).
+
+    refresh=True bỏ qua cache chuyến bay; cache_only=True chỉ đọc cache (xem fetch_flights).
+    """
+    on_info = on_info or _print_notice
+    on_warning = on_warning or _print_notice
+
+    data_main = fetch_flights(source, destination, departure_date, return_date, refresh=refresh,
+                              cache_only=cache_only)
+
+    cheapest_flights = []
+    try:
+        cheapest_flights = extract_cheapest_flights(data_main) or []
+    except Exception as e:
+        on_warning(f"extract_cheapest_flights lỗi: {e}")
+
+    if not cheapest_flights:
+        cheapest_flights = _fallback_pick_flights(data_main)
+
+    if not cheapest_flights:
+        try_dates = []
+        try:
+            d0 = _dt.date.fromisoformat(str(departure_date))
+            r0 = _dt.date.fromisoformat(str(return_date))
+            try_dates = [
+                (d0, r0),
+                (d0 + _dt.timedelta(days=1), r0 + _dt.timedelta(days=1)),
+                (d0 - _dt.timedelta(days=1), r0 - _dt.timedelta(days=1)),
+            ]
+        except Exception:
+            try_dates = []
+
+        for d, r in try_dates[1:]:
+            data_try = fetch_flights(source, destination, d, r, refresh=refresh, cache_only=cache_only)
+            cf = []
+            try:
+                cf = extract_cheapest_flights(data_try) or []
+            except:
+                pass
+            if not cf:
+                cf = _fallback_pick_flights(data_try)
+            if cf:
+                on_info(f"Không thấy kết quả ngày chính xác. Đã dùng khoảng ngày: {d} → {r}.")
+                cheapest_flights = cf
+                break
+
+    return cheapest_flights, data_main
+
+# ============== Prompts cho các agent ==========================
+def build_research_prompt(destination_city, activity_preferences, travel_theme, num_days):
+    return f"""
+Bạn là Travel Researcher.
+Điểm đến: {destination_city}.
+Sở thích: {activity_preferences}. Chủ đề: {travel_theme}. Số ngày: {num_days}.
+
+HÃY TRẢ VỀ VĂN BẢN THUẦN (KHÔNG MARKDOWN, KHÔNG BẢNG, KHÔNG TIÊU ĐỀ).
+Chỉ liệt kê theo dạng gạch đầu dòng, ngắn gọn, mỗi mục một dòng.
+
+Bao gồm:
+- Tổng quan nhanh: khí hậu theo mùa, lưu ý an toàn, tips di chuyển nội đô.
+- Danh sách 8–12 hoạt động phù hợp với "{travel_theme}" trong {num_days} ngày.
+- Mỗi hoạt động: tên + mô tả ngắn + khung giờ gợi ý (sáng/chiều/tối) + chi phí ước tính nếu có.
+Ngôn ngữ: tiếng Việt.
+            """.strip()
+
+def build_hotel_restaurant_prompt(destination_city, budget, hotel_rating, activity_preferences, num_days, travel_theme):
+    return f"""
+Bạn là Hotel & Restaurant Finder cho {destination_city}.
+Ngân sách ~{int(budget)} USD. Hạng khách sạn mong muốn: {hotel_rating}.
+Sở thích: {activity_preferences}. Hành trình: {num_days} ngày. Chủ đề: {travel_theme}.
+
+HÃY TRẢ VỀ VĂN BẢN THUẦN (KHÔNG MARKDOWN, KHÔNG BẢNG).
+Chỉ liệt kê danh sách gạch đầu dòng, mỗi dòng 1 mục đầy đủ thông tin.
+Chia phần 1 và phần 2 cho dễ nhìn. 
+
+Phần 1 - Khách sạn (8–12 gợi ý):
+- Tên khách sạn | Khu vực gần landmark | Hạng sao | Điểm đánh giá | Giá ước tính/đêm (USD) | Chính sách huỷ | Link đặt phòng (có chưa URL đầy đủ, đưa thẳng đến website, có chưa https://)
+
+Phần 2 - Nhà hàng/quán ăn (10–15 gợi ý, đủ sáng/trưa/tối, nhiều mức giá):
+- Tên | Loại ẩm thực | Khu vực | Mức giá/người (USD) | Có đặt bàn không | Link Maps/Website Link đặt phòng (có chưa URL đầy đủ, đưa thẳng đến website, có chưa https://)
+
+Ưu tiên vị trí thuận tiện và chỗ đáng tin cậy. Ngôn ngữ: tiếng Việt.
+            """.strip()
+
+def build_planning_prompt(destination_city, num_days, travel_theme, activity_preferences, budget, flight_class,
+                          hotel_rating, visa_required, travel_insurance, research_content, cheapest_flights,
+                          hotel_restaurant_content):
+    return (
+        f"Dựa trên dữ liệu sau, hãy tạo lịch trình {num_days} ngày cho chuyến đi {travel_theme.lower()} đến {destination_city}. "
+        f"Khách du lịch thích: {activity_preferences}. Ngân sách: khoảng {int(budget)} USD. Hạng vé: {flight_class}. Khách sạn: {hotel_rating}. "
+        f"Visa: {visa_required}. Bảo hiểm: {travel_insurance}. Nghiên cứu: {research_content}. "
+        f"Chuyến bay: {json.dumps(cheapest_flights, ensure_ascii=False)}. Khách sạn & Nhà hàng: {hotel_restaurant_content}."
+    )
+
+# ============== Pipeline đầy đủ (không phụ thuộc UI) ===========
+def _no_step(label):
+    return contextlib.nullcontext()
+
+def plan_trip(source, destination, destination_city, departure_date, return_date, num_days, travel_theme,
+              activity_preferences, budget, flight_class="Phổ thông", hotel_rating="Bất kỳ",
+              visa_required=False, travel_insurance=False, on_notice=None, on_info=None, on_warning=None,
+              on_error=None, step=None, store=None, reuse_max_age_days=7, refresh=False, cache_only=False):
+    """Chạy flights + research + hotels + planner tuần tự, trả về dict kết quả (chuỗi thuần, JSON được).
+
+    on_info/on_warning/on_error (mặc định on_notice) nhận thông báo; step(label) là context manager
+    bao quanh từng bước (vd: st.spinner). Nếu có store (ItineraryStore) và reuse_max_age_days > 0: tra
+    kho trước mọi lời gọi backend; kế hoạch gần đây khớp đúng tuyến/ngày/lựa chọn được trả lại nguyên
+    vẹn (kể cả chuyến bay đã lưu) mà không gọi SerpAPI/Gemini và không lưu thêm bản mới. Kế hoạch mới
+    được lưu khi không có phần nào bị fallback. refresh=True bỏ qua cache phản hồi SerpAPI/Gemini để tạo
+    mới hoàn toàn; cache_only=True không gọi backend nào và ném CacheMiss ở bước đầu tiên thiếu cache
+    (cache_warmer dùng để kiểm tra một chuyến đã được làm nóng đủ).
+    """
+    on_info = on_info or on_notice or _print_notice
+    on_warning = on_warning or on_notice or _print_notice
+    on_error = on_error or on_notice or _print_notice
+    step = step or _no_step
+    fallbacks = []
+    choices = {"flight_class": flight_class, "hotel_rating": hotel_rating, "visa_required": visa_required,
+               "travel_insurance": travel_insurance, "preferences": activity_preferences}
+
+    hit = None
+    if store is not None and reuse_max_age_days:
+        try:
+            hit = store.find_recent(source, destination, departure_date, return_date, travel_theme, num_days,
+                                    budget, max_age_days=reuse_max_age_days, **choices)
+            if hit:
+                store.mark_reused(hit["id"])
+        except Exception as e:
+            on_warning(f"Không đọc được kho kế hoạch đã lưu: {e}")
+    if hit:
+        saved_at = _dt.datetime.fromtimestamp(hit["created_at"]).strftime("%d/%m/%Y %H:%M")
+        on_info(f"♻️ Dùng lại kế hoạch đã tạo lúc {saved_at} cho cùng chuyến bay và lựa chọn "
+                f"(giá vé là giá lúc đó).")
+        return {
+            "flights": json.loads(hit["flights_json"] or "[]"),
+            "flight_data": None,
+            "research": hit["research"],
+            "hotels_restaurants": hit["hotels_restaurants"],
+            "itinerary": hit["itinerary"],
+            "fallbacks": [],
+            "plan_id": None,
+            "reused": True,
+            "reused_plan_id": hit["id"],
+        }
+
+    with step("Đang tìm chuyến bay tốt nhất..."):
+        cheapest_flights, data_main = search_flights(
+            source, destination, departure_date, return_date,
+            on_info=on_info, on_warning=on_warning, refresh=refresh, cache_only=cache_only,
+        )
+
+    # ---------- Research: TRẢ VỀ VĂN BẢN THUẦN ----------
+    with step("Đang tìm điểm đến & hoạt động nổi bật..."):
+        research_results = safe_agent_run(
+            agents.make_researcher(),
+            build_research_prompt(destination_city, activity_preferences, travel_theme, num_days),
+            retries=3, base_wait=4.0, component_name="Nghiên cứu điểm đến",
+            on_retry=on_warning, on_fail=on_error, refresh=refresh, cache_only=cache_only,
+        )
+
+    # ---------- Hotels & Restaurants: VĂN BẢN THUẦN ----------
+    with step("Đang tìm khách sạn & nhà hàng..."):
+        hotel_restaurant_results = safe_agent_run(
+            agents.make_hotel_restaurant_finder(),
+            build_hotel_restaurant_prompt(destination_city, budget, hotel_rating, activity_preferences, num_days, travel_theme),
+            retries=3, base_wait=4.0, component_name="Khách sạn & Nhà hàng",
+            on_retry=on_warning, on_fail=on_error, refresh=refresh, cache_only=cache_only,
+        )
+
+    with step("Đang tạo lịch trình cá nhân hóa..."):
+        planning_prompt = build_planning_prompt(
+            destination_city, num_days, travel_theme, activity_preferences, budget, flight_class, hotel_rating,
+            visa_required, travel_insurance, research_results.content, cheapest_flights,
+            hotel_restaurant_results.content,
+        )
+        itinerary = safe_agent_run(
+            agents.make_planner(), planning_prompt, retries=3, base_wait=4.0,
+            component_name="Lập lịch trình",
+            on_retry=on_warning, on_fail=on_error, refresh=refresh, cache_only=cache_only,
+        )
+
+    for name, resp in (("research", research_results),
+                       ("hotels_restaurants", hotel_restaurant_results),
+                       ("itinerary", itinerary)):
+        if isinstance(resp, FallbackResponse):
+            fallbacks.append(name)
+
+    # Chỉ lưu khi cả 3 phần đều do AI tạo thành công (không lưu nội dung fallback)
+    plan_id = None
+    if store is not None and not fallbacks:
+        try:
+            plan_id = store.save(
+                source, destination, departure_date, return_date, travel_theme, num_days, budget,
+                research_results.content, hotel_restaurant_results.content, itinerary.content,
+                flights=cheapest_flights, destination_label=destination_city, **choices,
+            )
+        except Exception as e:
+            on_warning(f"Không lưu được kế hoạch: {e}")
+
+    return {
+        "flights": cheapest_flights,
+        "flight_data": data_main,
+        "research": research_results.content,
+        "hotels_restaurants": hotel_restaurant_results.content,
+        "itinerary": itinerary.content,
+        "fallbacks": fallbacks,
+        "plan_id": plan_id,
+        "reused": False,
+        "reused_plan_id": None,
+    }
@@ -1,6 +1,9 @@
+import threading
+import time
 from datetime import datetime
 from serpapi import GoogleSearch
-from config import SERPAPI_KEY
+from config import SERPAPI_KEY, FLIGHT_CACHE_TTL_HOURS
+from response_cache import CacheMiss, get_default_cache, make_key
 
 def format_datetime(iso_string):
     try:
@@ -9,7 +12,14 @@ def format_datetime(iso_string):
     except Exception:
         return "N/A"
 
-def fetch_flights(source, destination, departure_date, return_date):
+def flight_cache_key(source, destination, departure_date, return_date, currency="INR", hl="en"):
+    return make_key(source, destination, str(departure_date), str(return_date), currency, hl)
+
+def fetch_flights(source, destination, departure_date, return_date, refresh=False, cache_only=False):
+    """Gọi Google Flights qua SerpAPI, có cache (refresh=True: bỏ qua cache và ghi đè).
+
+    cache_only=True: không gọi SerpAPI, ném CacheMiss nếu cache không có kết quả còn hạn.
+    """
     params = {
         "engine": "google_flights",
         "departure_id": source,
@@ -20,11 +30,50 @@ def fetch_flights(source, destination, departure_date, return_date):
         "hl": "en",
         "api_key": SERPAPI_KEY
     }
+    cache = get_default_cache()
+    key = flight_cache_key(source, destination, departure_date, return_date, params["currency"], params["hl"])
+    if cache is not None and not refresh:
+        cached = cache.get("flights", key)
+        if cached is not None:
+            return cached
+    if cache_only:
+        raise CacheMiss(f"flights {source}->{destination} {departure_date}/{return_date}")
+
+    throttle("serpapi")
     search = GoogleSearch(params)
     results = search.get_dict()
+    if cache is not None and isinstance(results, dict) and not results.get("error"):
+        cache.set("flights", key, results, FLIGHT_CACHE_TTL_HOURS * 3600)
     return results
 
 def extract_cheapest_flights(flight_data):
     best_flights = flight_data.get("best_flights", [])
     sorted_flights = sorted(best_flights, key=lambda x: x.get("price", float("inf")))[:3]
-    return sorted_flights
\ No newline at end of file
+    return sorted_flights
+
+class RateLimiter:
+    """Giới hạn số lần bắt đầu mỗi phút (0 = không giới hạn), an toàn khi nhiều thread cùng gọi."""
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# Giới hạn lời gọi thật tới backend trong process hiện tại (mặc định không giới hạn; batch_plan đặt qua
+# set_backend_rate). "llm" tính từng lần agent.run, không gồm SerpApiTools mà agent tự gọi bên trong.
+_BACKEND_LIMITERS = {"serpapi": RateLimiter(0), "llm": RateLimiter(0)}
+
+def set_backend_rate(kind: str, per_minute: float):
+    _BACKEND_LIMITERS[kind] = RateLimiter(per_minute)
+
+def throttle(kind: str):
+    _BACKEND_LIMITERS[kind].acquire()